@@ -1,11 +1,36 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g
 from flask_cors import CORS
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+import abc
+import bisect
+import contextlib
+import copy
+import csv
+import functools
+import hashlib
+import hmac
+import io
 import json
+import logging
+import math
 import os
+import queue
+import random
+import re
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+import uuid
 from dotenv import load_dotenv
+import numpy as np
 import requests
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlparse
+
+# Start of module execution, for the startup report (dependency imports
+# above are not included)
+_startup_started = time.perf_counter()
 
 # Load environment variables
 load_dotenv()
@@ -14,28 +39,314 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
+# ============================================================================
+# LOGGING AND METRICS
+# ============================================================================
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line with severity and message, as Cloud Logging expects.
+
+    Anything passed through `extra=` becomes a field of the entry.
+    """
+
+    _RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(),
+            'severity': record.levelname,
+            'message': record.getMessage()
+        }
+        entry.update((k, v) for k, v in vars(record).items() if k not in self._RECORD_ATTRS)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+logger = logging.getLogger('training')
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(JsonLogFormatter())
+logger.addHandler(_log_handler)
+logger.setLevel(os.getenv('LOG_LEVEL', 'INFO'))
+logger.propagate = False
+
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metrics:
+    """Counters, histograms and scrape-time gauges in the Prometheus text format.
+
+    The app runs as one gunicorn worker, so a single in-process registry
+    sees every request. Histograms keep per-bucket counts and are made
+    cumulative only when rendered.
+    """
+
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+
+    def describe(self, name, kind, help_text):
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            idx = bisect.bisect_left(self.buckets, seconds)
+            if idx < len(self.buckets):
+                hist[idx] += 1
+            hist[-2] += seconds
+            hist[-1] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def gauge(self, name, help_text, collect):
+        """Register a gauge; collect() returns [(labels dict, value)] at scrape time"""
+        self.describe(name, 'gauge', help_text)
+        self._gauges[name] = collect
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ''
+        escaped = (
+            k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+            for k, v in pairs
+        )
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self):
+        with self._lock:
+            samples = {}
+            for (name, labels), value in self._counters.items():
+                samples.setdefault(name, []).append(f"{name}{self._labels(labels)} {value}")
+            for (name, labels), hist in self._histograms.items():
+                lines = samples.setdefault(name, [])
+                cumulative = 0
+                for bound, count in zip(self.buckets, hist):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', '+Inf'),))} {hist[-1]}")
+                lines.append(f"{name}_sum{self._labels(labels)} {hist[-2]:.6f}")
+                lines.append(f"{name}_count{self._labels(labels)} {hist[-1]}")
+        for name, collect in self._gauges.items():
+            samples[name] = [
+                f"{name}{self._labels(tuple(sorted(labels.items())))} {value}"
+                for labels, value in collect()
+            ]
+        out = []
+        for name in sorted(samples):
+            kind, help_text = self._meta.get(name, ('untyped', name))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(samples[name])
+        return '\n'.join(out) + '\n'
+
+
+metrics = Metrics()
+metrics.describe('http_request_duration_seconds', 'histogram', 'Request latency by route, method and status')
+metrics.describe('storage_operation_duration_seconds', 'histogram', 'Storage call latency by store, operation and backend')
+metrics.describe('storage_records_total', 'counter', 'Records read or written by store, operation and backend')
+metrics.describe('strava_request_duration_seconds', 'histogram', 'Strava API call latency by endpoint and status')
+metrics.describe('strava_retries_total', 'counter', 'Strava calls retried, by reason')
+metrics.describe('strava_rate_limit_refusals_total', 'counter', 'Strava calls refused locally because a rate-limit window was spent')
+
+
+def storage_timer(store, op):
+    """Time one storage call as storage_operation_duration_seconds"""
+    return metrics.timer('storage_operation_duration_seconds', store=store, op=op,
+                         backend=storage.name)
+
+
+def count_storage_records(store, op, count):
+    metrics.inc('storage_records_total', count, store=store, op=op,
+                backend=storage.name)
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.observe(
+            'http_request_duration_seconds', time.perf_counter() - started,
+            method=request.method,
+            route=request.url_rule.rule if request.url_rule else 'unmatched',
+            status=str(response.status_code)
+        )
+    return response
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Request, storage, Strava and job metrics in the Prometheus text format"""
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# ============================================================================
+# STARTUP AND LAZY COMPONENTS
+# ============================================================================
+
+# Build every lazy component in a background thread right after import, so
+# they are usually ready before the first request needs them
+WARMUP_ON_START = os.getenv('WARMUP_ON_START', '').lower() in ('1', 'true', 'yes')
+
+_lazy_components = {}
+_startup = {}
+
+
+class LazyComponent:
+    """A process-wide client (storage backend, Strava session) built on first use.
+
+    Creating the Firestore client means importing the google-cloud stack and
+    resolving credentials, which would otherwise add seconds to every cold
+    start, even for requests that never touch it. Attribute access is
+    forwarded to the built object, so call sites use the component as if it
+    were the object itself. A failed build is logged and retried on the
+    next use.
+    """
+
+    __slots__ = ('_name', '_build', '_lock', '_instance', '_seconds')
+
+    def __init__(self, name, build):
+        self._name = name
+        self._build = build
+        self._lock = threading.Lock()
+        self._instance = None
+        self._seconds = None
+        _lazy_components[name] = self
+
+    @property
+    def _ready(self):
+        return self._instance is not None
+
+    def _get(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                if self._instance is None:
+                    started = time.perf_counter()
+                    try:
+                        self._instance = self._build()
+                    except Exception as e:
+                        logger.error('Component failed to initialize',
+                                     extra={'component': self._name, 'error': str(e)})
+                        raise
+                    self._seconds = time.perf_counter() - started
+                    logger.info('Component initialized', extra={
+                        'component': self._name, 'seconds': round(self._seconds, 4),
+                        'since_start': round(time.perf_counter() - _startup_started, 4)
+                    })
+                instance = self._instance
+        return instance
+
+    def __getattr__(self, attr):
+        # The proxy's own fields (unset while copying or unpickling) and
+        # special methods are never forwarded
+        if attr in LazyComponent.__slots__ or attr.startswith('__'):
+            raise AttributeError(attr)
+        return getattr(self._get(), attr)
+
+    def __setattr__(self, attr, value):
+        if attr in LazyComponent.__slots__:
+            object.__setattr__(self, attr, value)
+        else:
+            setattr(self._get(), attr, value)
+
+
+def warm_up(names=None):
+    """Build the named lazy components (default all) now; {name: build seconds}"""
+    timings = {}
+    for name, component in _lazy_components.items():
+        if names is None or name in names:
+            component._get()
+            timings[name] = round(component._seconds, 4)
+    return timings
+
+
+def _warm_up_in_background():
+    try:
+        warm_up()
+    except Exception:
+        pass  # already logged; the component is retried on first use
+
+
+def startup_report():
+    """How long module import took and which lazy components are built so far"""
+    return {
+        'import_seconds': _startup.get('import_seconds'),
+        'components': {
+            name: {'ready': c._ready, 'seconds': round(c._seconds, 4) if c._ready else None}
+            for name, c in _lazy_components.items()
+        }
+    }
+
+
+@app.route('/_ah/warmup')
+def warmup():
+    """Build every lazy component before traffic arrives; point a startup probe here"""
+    try:
+        warm_up()
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e), **startup_report()}), 503
+    return jsonify({'success': True, **startup_report()})
+
+
+metrics.gauge('startup_component_seconds', 'Time taken to build each lazy component, once built', lambda: [
+    ({'component': name}, f'{c._seconds:.6f}') for name, c in _lazy_components.items() if c._ready
+])
+metrics.gauge('startup_import_seconds', 'Time taken to import the app module', lambda: [
+    ({}, f"{_startup['import_seconds']:.6f}")
+] if 'import_seconds' in _startup else [])
+
+
 STRAVA_CLIENT_ID = os.getenv('STRAVA_CLIENT_ID', '')
 STRAVA_CLIENT_SECRET = os.getenv('STRAVA_CLIENT_SECRET', '')
 STRAVA_REDIRECT_URI = os.getenv('STRAVA_REDIRECT_URI', 'http://localhost:8080/api/strava/callback')
 STRAVA_AUTH_URL = 'https://www.strava.com/oauth/authorize'
-STRAVA_TOKEN_URL = 'https://www.strava.com/oauth/token'
-STRAVA_API_BASE = 'https://www.strava.com/api/v3'
+STRAVA_TOKEN_URL = os.getenv('STRAVA_TOKEN_URL', 'https://www.strava.com/oauth/token')
+STRAVA_API_BASE = os.getenv('STRAVA_API_BASE', 'https://www.strava.com/api/v3')
 
-# Try to import Firestore, fallback to local storage if not available
-try:
-    from google.cloud import firestore
-    db = firestore.Client()
-    USE_FIRESTORE = True
-except Exception as e:
-    print(f"Firestore not available, using local storage: {e}")
-    USE_FIRESTORE = False
-    LOCAL_DATA = {}
+# Where data lives: firestore, json (local files) or sqlite; see STORAGE
+# BACKENDS. Unset means Firestore when a client can be created, else json.
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', '').strip().lower()
+STORAGE_BACKENDS = ('firestore', 'json', 'sqlite')
+
+# Firestore rejects write batches with more than 500 operations
+FIRESTORE_BATCH_LIMIT = 500
 
 # Training plan data structure
 TRAINING_PLAN = {
     "race_date": "2026-02-28",
     "goal": "Sub 1:50:00 (8:24/mile pace)",
     "race_name": "Wilmington Half Marathon",
+    "paces": {
+        "easy": "9:45-10:30",
+        "marathon": "8:45-9:00",
+        "threshold": "8:05-8:15",
+        "interval": "7:30-7:40",
+        "race": "8:20-8:25"
+    },
     "weeks": [
         {
             "week_num": 1,
@@ -248,398 +559,2622 @@ TRAINING_PLAN = {
     ]
 }
 
-# File to store workout completions (fallback)
-DATA_FILE = '/tmp/workout_data.json'
+DEFAULT_PLAN_ID = 'wilmington-half-2026'
+PLAN_CACHE_MAX_AGE = 300
 
-def load_workout_data():
-    """Load saved workout completion data"""
-    if USE_FIRESTORE:
-        try:
-            workouts_ref = db.collection('workouts')
-            docs = workouts_ref.stream()
-            data = {}
-            for doc in docs:
-                data[doc.id] = doc.to_dict()
-            return data
-        except Exception as e:
-            print(f"Error loading from Firestore: {e}")
-            return {}
-    else:
-        if os.path.exists(DATA_FILE):
-            try:
-                with open(DATA_FILE, 'r') as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
 
-def save_workout_data(key, data):
-    """Save workout completion data"""
-    if USE_FIRESTORE:
-        try:
-            db.collection('workouts').document(key).set(data)
-            return True
-        except Exception as e:
-            print(f"Error saving to Firestore: {e}")
-            return False
-    else:
-        all_data = load_workout_data()
-        all_data[key] = data
-        try:
-            with open(DATA_FILE, 'w') as f:
-                json.dump(all_data, f, indent=2)
-            return True
-        except Exception as e:
-            print(f"Error saving to file: {e}")
-            return False
+WORKOUT_KEY_RE = re.compile(r'^w(\d+)_')
 
-@app.route('/')
-def index():
-    """Main page showing the full training plan"""
-    # All data now fetched via API endpoints - no template variables needed
-    return render_template('index.html')
 
+class PlanSlot:
+    """One calendar day of a compiled plan"""
 
-@app.route('/api/log_workout', methods=['POST'])
-def log_workout():
-    """Log a workout as completed"""
-    data = request.json
-    week = data.get('week')
-    day = data.get('day')
-    completed = data.get('completed', False)
-    notes = data.get('notes', '')
-    actual_miles = data.get('actual_miles', '')
-    actual_pace = data.get('actual_pace', '')
-    duration = data.get('duration', '')
-    strava_data = data.get('strava_data')
-    
-    key = f"w{week}_d{day}"
-    
-    # Check if this is effectively empty (no actual workout data)
-    is_empty = (
-        not actual_miles or 
-        actual_miles.strip() == '' or 
-        float(actual_miles) == 0
-    ) and not notes.strip()
-    
-    # If empty, delete the workout record instead of saving
-    if is_empty:
-        if USE_FIRESTORE:
-            try:
-                db.collection('workouts').document(key).delete()
-                return jsonify({'success': True, 'deleted': True, 'message': 'Workout data cleared'})
-            except Exception as e:
-                print(f"Error deleting workout: {e}")
-                return jsonify({'success': False, 'error': 'Failed to delete workout'}), 500
-        else:
-            all_data = load_workout_data()
-            if key in all_data:
-                del all_data[key]
-                try:
-                    with open(DATA_FILE, 'w') as f:
-                        json.dump(all_data, f, indent=2)
-                    return jsonify({'success': True, 'deleted': True, 'message': 'Workout data cleared'})
-                except Exception as e:
-                    print(f"Error deleting workout: {e}")
-                    return jsonify({'success': False, 'error': 'Failed to delete workout'}), 500
-    
-    # Load existing data to preserve edit information
-    existing_data = load_workout_data()
-    if key in existing_data:
-        workout_info = existing_data[key]
-    else:
-        workout_info = {}
-    
-    # Update with logging data (preserves existing edit data)
-    workout_info.update({
-        'completed': completed,
-        'notes': notes,
-        'actual_miles': actual_miles,
-        'actual_pace': actual_pace,
-        'duration': duration,
-        'date_logged': datetime.now().isoformat()
-    })
-    
-    # Add Strava data if present
-    if strava_data:
-        workout_info['strava_data'] = strava_data
-    
-    success = save_workout_data(key, workout_info)
-    
-    if success:
-        return jsonify({'success': True, 'data': workout_info})
-    else:
-        return jsonify({'success': False, 'error': 'Failed to save workout'}), 500
+    __slots__ = ('key', 'week_num', 'week_idx', 'day_idx', 'date', 'day_type', 'miles', 'workout')
 
-@app.route('/api/edit_workout', methods=['POST'])
-def edit_workout():
-    """Edit/modify a planned workout"""
-    data = request.json
-    week = data.get('week')
-    day = data.get('day')
-    
-    # Original workout info
-    original_workout = data.get('original_workout')
-    original_miles = data.get('original_miles')
-    
-    # Modified workout info
-    modified_workout = data.get('modified_workout')
-    modified_miles = data.get('modified_miles')
-    modified_type = data.get('modified_type')
-    modification_reason = data.get('modification_reason', '')
-    
-    key = f"w{week}_d{day}"
-    
-    # Load existing data or create new
-    existing_data = load_workout_data()
-    if key not in existing_data:
-        workout_info = {}
-    else:
-        workout_info = existing_data[key]
-    
-    # Update with modification
-    workout_info.update({
-        'is_modified': True,
-        'original_workout': original_workout,
-        'original_miles': original_miles,
-        'modified_workout': modified_workout,
-        'modified_miles': modified_miles,
-        'modified_type': modified_type,
-        'modification_reason': modification_reason,
-        'modified_date': datetime.now().isoformat()
-    })
-    
-    success = save_workout_data(key, workout_info)
-    
-    if success:
-        return jsonify({'success': True, 'data': workout_info})
-    else:
-        return jsonify({'success': False, 'error': 'Failed to save modification'}), 500
+    def __init__(self, key, week_num, week_idx, day_idx, day, day_type, miles, workout):
+        self.key = key
+        self.week_num = week_num
+        self.week_idx = week_idx
+        self.day_idx = day_idx
+        self.date = day
+        self.day_type = day_type
+        self.miles = miles
+        self.workout = workout
 
-@app.route('/api/revert_workout', methods=['POST'])
-def revert_workout():
-    """Revert a modified workout back to original"""
-    data = request.json
-    week = data.get('week')
-    day = data.get('day')
-    
-    key = f"w{week}_d{day}"
-    
-    # Load existing data
-    existing_data = load_workout_data()
-    
-    if key in existing_data:
-        workout_info = existing_data[key]
-        # Remove modification flags but keep completion status
-        workout_info['is_modified'] = False
-        workout_info.pop('modified_workout', None)
-        workout_info.pop('modified_miles', None)
-        workout_info.pop('modified_type', None)
-        workout_info.pop('modification_reason', None)
-        workout_info.pop('modified_date', None)
-        
-        success = save_workout_data(key, workout_info)
-        
-        if success:
-            return jsonify({'success': True, 'data': workout_info})
-        else:
-            return jsonify({'success': False, 'error': 'Failed to revert'}), 500
-    
-    return jsonify({'success': False, 'error': 'Workout not found'}), 404
 
-@app.route('/api/get_stats')
-def get_stats():
-    """Get training statistics"""
-    workout_data = load_workout_data()
-    
-    total_workouts = sum(
-        len([w for w in week['workouts'] if w['miles'] > 0])
-        for week in TRAINING_PLAN['weeks']
-    )
-    
-    completed_workouts = sum(
-        1 for v in workout_data.values() if v.get('completed', False)
+def compile_plan_slots(plan):
+    """Flatten a plan into PlanSlot records in calendar order.
+
+    The plan covers consecutive days, so anchor on the RACE workout (which
+    falls on race_date) and count every other slot from there. Plans without
+    a RACE workout end on race_date.
+    """
+    rows = [
+        (week_idx, week['week_num'], day_idx, workout)
+        for week_idx, week in enumerate(plan['weeks'])
+        for day_idx, workout in enumerate(week['workouts'])
+    ]
+    race_idx = next((i for i, row in enumerate(rows) if row[3]['day_type'] == 'RACE'), len(rows) - 1)
+    start = date.fromisoformat(plan['race_date']) - timedelta(days=race_idx)
+    return tuple(
+        PlanSlot(f"w{week_num}_d{day_idx}", week_num, week_idx, day_idx,
+                 start + timedelta(days=i), workout['day_type'], workout['miles'], workout['workout'])
+        for i, (week_idx, week_num, day_idx, workout) in enumerate(rows)
     )
-    
-    total_planned_miles = sum(week['total_miles'] for week in TRAINING_PLAN['weeks'])
-    
-    # Calculate total completed miles
-    completed_miles = 0
-    for key, value in workout_data.items():
-        if value.get('completed', False):
-            actual = value.get('actual_miles', '')
-            if actual:
-                try:
-                    completed_miles += float(actual)
-                except:
-                    pass
-    
-    # Calculate weekly breakdown for chart
-    weekly_actual_miles = [0] * 13
-    for key, value in workout_data.items():
-        if value.get('completed', False) and value.get('actual_miles'):
-            try:
-                # Parse key format: w1_d1 -> week 1
-                week_num = int(key.split('_')[0][1:]) - 1  # w1 -> 0, w2 -> 1, etc.
-                if 0 <= week_num < 13:
-                    weekly_actual_miles[week_num] += float(value['actual_miles'])
-            except (ValueError, IndexError):
-                pass
-    
-    # Round weekly miles to 1 decimal place
-    weekly_actual_miles = [round(miles, 1) for miles in weekly_actual_miles]
-    
-    return jsonify({
-        'total_workouts': total_workouts,
-        'completed_workouts': completed_workouts,
-        'completion_percentage': round((completed_workouts / total_workouts * 100), 1) if total_workouts > 0 else 0,
-        'total_planned_miles': total_planned_miles,
-        'completed_miles': round(completed_miles, 1),
-        'weekly_actual_miles': weekly_actual_miles  # NEW: Weekly breakdown for chart
-    })
 
-@app.route('/api/get_plan')
-def get_plan():
-    """Get the full training plan"""
-    return jsonify(TRAINING_PLAN)
 
-@app.route('/api/get_workouts')
-def get_workouts():
-    """Get all workout data from Firestore"""
-    workout_data = load_workout_data()
-    return jsonify(workout_data)
+class PlanInfo:
+    """A training plan compiled once into slots, totals and its served payload.
 
-@app.route('/api/reset_plan', methods=['POST'])
-def reset_plan():
-    """Reset all workout data (for QA/testing)"""
-    try:
-        if USE_FIRESTORE:
-            # Delete all documents in workouts collection
-            workouts_ref = db.collection('workouts')
-            docs = workouts_ref.stream()
-            deleted_count = 0
-            for doc in docs:
-                doc.reference.delete()
-                deleted_count += 1
-            return jsonify({
-                'success': True,
-                'message': f'Reset complete! Deleted {deleted_count} logged workouts.',
-                'deleted_count': deleted_count
-            })
-        else:
-            # Clear local storage
-            global LOCAL_DATA
-            LOCAL_DATA = {}
-            return jsonify({
-                'success': True,
-                'message': 'Reset complete! All data cleared.',
-                'deleted_count': 0
-            })
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+    Plans never change once registered, so the JSON payload (with each
+    workout's ISO date filled in), its ETag, the plan totals and the
+    key/date indexes are built when the plan is loaded instead of on every
+    request.
+    """
+
+    def __init__(self, plan_id, plan):
+        self.plan_id = plan_id
+        self.plan = plan
+        self.slots = compile_plan_slots(plan)
+        self.slot_by_key = {slot.key: slot for slot in self.slots}
+        self.start_date = self.slots[0].date
+        self.end_date = self.slots[-1].date
+        self.num_weeks = len(plan['weeks'])
+        self.total_run_workouts = sum(1 for slot in self.slots if slot.miles > 0)
+        self.total_planned_miles = sum(week['total_miles'] for week in plan['weeks'])
+        
+        dates = iter(self.slots)
+        served = dict(plan, weeks=[
+            dict(week, workouts=[dict(workout, date=next(dates).date.isoformat()) for workout in week['workouts']])
+            for week in plan['weeks']
+        ])
+        self.json = json.dumps(served, separators=(',', ':'))
+        self.etag = hashlib.sha256(self.json.encode('utf-8')).hexdigest()[:32]
+
+    def slot_on(self, day):
+        """The slot scheduled on a calendar date, or None outside the plan"""
+        offset = (day - self.start_date).days
+        return self.slots[offset] if 0 <= offset < len(self.slots) else None
+
+    def week_index(self, key):
+        """0-based plan week for a workout key (parsed from the key if it isn't a plan slot)"""
+        slot = self.slot_by_key.get(key)
+        if slot is not None:
+            return slot.week_idx
+        match = WORKOUT_KEY_RE.match(key)
+        return int(match.group(1)) - 1 if match else None
 
-# ============================================================================
-# STRAVA INTEGRATION ENDPOINTS
-# ============================================================================
 
-def get_valid_strava_token():
-    """Get valid Strava access token, refresh if needed"""
+# A pace zone as plans write it: "m:ss-m:ss" per mile
+PLAN_PACE_RANGE_RE = re.compile(r'^\s*\d+:[0-5]\d\s*-\s*\d+:[0-5]\d\s*$')
+
+
+def validate_plan(plan):
+    """Raise ValueError unless `plan` has the shape of TRAINING_PLAN"""
+    if not isinstance(plan, dict) or not isinstance(plan.get('weeks'), list) or not plan['weeks']:
+        raise ValueError('plan must be an object with a non-empty weeks list')
     try:
-        if not USE_FIRESTORE:
+        date.fromisoformat(plan.get('race_date', ''))
+    except (TypeError, ValueError):
+        raise ValueError('plan.race_date must be YYYY-MM-DD')
+    for week_idx, week in enumerate(plan['weeks']):
+        if not isinstance(week, dict) or not isinstance(week.get('week_num'), int):
+            raise ValueError('every week needs an integer week_num')
+        # Workout keys are w{week_num}_d{day}, so weeks must be numbered 1..n
+        if week['week_num'] != week_idx + 1:
+            raise ValueError(f"week_num must run 1, 2, 3, ... in order (week {week_idx + 1} is numbered {week['week_num']})")
+        if not isinstance(week.get('total_miles'), (int, float)) or not isinstance(week.get('workouts'), list):
+            raise ValueError(f"week {week['week_num']} needs total_miles and a workouts list")
+        for workout in week['workouts']:
+            if not isinstance(workout, dict) or not all(k in workout for k in ('day', 'workout', 'day_type', 'miles')):
+                raise ValueError(f"week {week['week_num']} workouts need day, workout, day_type and miles")
+            if not isinstance(workout['miles'], (int, float)):
+                raise ValueError(f"week {week['week_num']} workout miles must be numbers")
+    if not any(week['workouts'] for week in plan['weeks']):
+        raise ValueError('plan must contain at least one workout')
+    paces = plan.get('paces')
+    if paces is not None and (not isinstance(paces, dict) or not all(
+            isinstance(v, str) and PLAN_PACE_RANGE_RE.match(v) for v in paces.values())):
+        raise ValueError('plan.paces must map zone names to "m:ss-m:ss" ranges')
+
+# Files to store workout completions with the json backend: a compacted
+# snapshot plus an append-only journal of the upserts/deletes made since the
+# last compaction
+DATA_FILE = os.getenv('WORKOUT_DATA_FILE', '/tmp/workout_data.json')
+JOURNAL_FILE = os.getenv('WORKOUT_JOURNAL_FILE', DATA_FILE + '.journal')
+JOURNAL_COMPACT_EVERY = int(os.getenv('WORKOUT_JOURNAL_COMPACT_EVERY', '500'))
+
+# Data is scoped per athlete. The default athlete keeps the original
+# single-user locations (top-level Firestore collections, /tmp files) so
+# existing deployments carry on unchanged; other athletes live under
+# athletes/{athlete_id}/... in Firestore, in suffixed local files and under
+# their own athlete_id in SQLite.
+DEFAULT_ATHLETE_ID = 'default'
+ATHLETE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def athlete_file(athlete_id, path):
+    """Local file path scoped to one athlete"""
+    if athlete_id == DEFAULT_ATHLETE_ID:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{athlete_id}{ext}"
+
+class TrainingStats:
+    """Completion counts and mileage totals maintained per workout mutation.
+
+    Each record's contribution (completed flag, plan week, miles) is worked
+    out once when it is written; updating a record only re-sums the week it
+    belongs to, so reading the totals never rescans the dataset.
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.num_weeks = plan.num_weeks
+        self._contrib = {}
+        self._bucket_miles = {}
+        self._bucket_totals = {}
+        self.completed_workouts = 0
+
+    @staticmethod
+    def _completed_miles(record):
+        if not record.get('completed', False) or not record.get('actual_miles'):
             return None
-            
-        token_doc = db.collection('strava_tokens').document('user_token').get()
-        
-        if not token_doc.exists:
+        try:
+            return float(record['actual_miles'])
+        except (TypeError, ValueError):
             return None
-        
-        token_data = token_doc.to_dict()
-        
-        # Check if token is expired (expires_at is Unix timestamp)
-        if datetime.now().timestamp() >= token_data.get('expires_at', 0):
-            # Token expired, refresh it
-            print("Strava token expired, refreshing...")
-            refresh_data = {
-                'client_id': STRAVA_CLIENT_ID,
-                'client_secret': STRAVA_CLIENT_SECRET,
-                'grant_type': 'refresh_token',
-                'refresh_token': token_data['refresh_token']
-            }
-            
-            response = requests.post(STRAVA_TOKEN_URL, data=refresh_data)
-            response.raise_for_status()
-            new_tokens = response.json()
-            
-            # Update stored tokens
-            db.collection('strava_tokens').document('user_token').update({
-                'access_token': new_tokens['access_token'],
-                'refresh_token': new_tokens['refresh_token'],
-                'expires_at': new_tokens['expires_at'],
-                'updated_at': datetime.now().isoformat()
-            })
-            
-            print("Strava token refreshed successfully")
-            return new_tokens['access_token']
-        
-        return token_data['access_token']
-    
-    except Exception as e:
-        print(f"Error getting Strava token: {e}")
-        return None
 
-@app.route('/api/strava/authorize')
-def strava_authorize():
-    """Redirect user to Strava authorization page"""
-    if not STRAVA_CLIENT_ID:
-        return jsonify({'error': 'Strava not configured. Please set STRAVA_CLIENT_ID in environment.'}), 500
-    
-    params = {
-        'client_id': STRAVA_CLIENT_ID,
-        'redirect_uri': STRAVA_REDIRECT_URI,
-        'response_type': 'code',
-        'scope': 'activity:read_all',
-        'approval_prompt': 'auto'
-    }
-    auth_url = f"{STRAVA_AUTH_URL}?{urlencode(params)}"
-    return jsonify({'auth_url': auth_url})
+    def rebuild(self, data):
+        """Recompute every total from a full set of records"""
+        self._contrib = {}
+        self._bucket_miles = {}
+        self._bucket_totals = {}
+        self.completed_workouts = 0
+        for key, record in data.items():
+            self.update(key, record)
 
-@app.route('/api/strava/callback')
-def strava_callback():
-    """Handle OAuth callback from Strava"""
-    code = request.args.get('code')
-    
-    if not code:
-        return '<html><body><h2>❌ Authorization failed</h2><p>No authorization code received.</p><button onclick="window.close()">Close</button></body></html>'
-    
-    try:
-        # Exchange code for access token
-        token_data = {
-            'client_id': STRAVA_CLIENT_ID,
-            'client_secret': STRAVA_CLIENT_SECRET,
-            'code': code,
-            'grant_type': 'authorization_code'
+    def update(self, key, record):
+        """Replace one record's contribution (record=None removes it)"""
+        old = self._contrib.pop(key, None)
+        if old is not None:
+            bucket, completed, _ = old
+            self.completed_workouts -= completed
+            self._bucket_miles.get(bucket, {}).pop(key, None)
+            self._resum(bucket)
+        if record is None:
+            return
+
+        week_idx = self.plan.week_index(key)
+        bucket = week_idx if week_idx is not None and 0 <= week_idx < self.num_weeks else None
+        completed = 1 if record.get('completed', False) else 0
+        miles = self._completed_miles(record)
+        self._contrib[key] = (bucket, completed, miles)
+        self.completed_workouts += completed
+        if miles is not None:
+            self._bucket_miles.setdefault(bucket, {})[key] = miles
+            self._resum(bucket)
+
+    def _resum(self, bucket):
+        self._bucket_totals[bucket] = math.fsum(self._bucket_miles.get(bucket, {}).values())
+
+    def snapshot(self):
+        """Return the current totals"""
+        return {
+            'completed_workouts': self.completed_workouts,
+            'completed_miles': round(math.fsum(self._bucket_totals.values()), 1),
+            'weekly_actual_miles': [
+                round(self._bucket_totals.get(i, 0), 1) for i in range(self.num_weeks)
+            ]
         }
-        
-        response = requests.post(STRAVA_TOKEN_URL, data=token_data)
-        response.raise_for_status()
-        tokens = response.json()
-        
-        # Store tokens in Firestore
-        if USE_FIRESTORE:
-            db.collection('strava_tokens').document('user_token').set({
-                'access_token': tokens['access_token'],
-                'refresh_token': tokens['refresh_token'],
-                'expires_at': tokens['expires_at'],
-                'athlete_id': tokens['athlete']['id'],
-                'athlete_name': f"{tokens['athlete']['firstname']} {tokens['athlete']['lastname']}",
-                'updated_at': datetime.now().isoformat()
+
+
+class WorkoutStore:
+    """Process-local copy of one athlete's workouts with write-through saves.
+
+    The backend is read once on first use; after that reads are served from
+    memory and each save/delete writes just the one document through to the
+    backend before updating the in-memory copy. A single lock keeps the
+    gunicorn threads from interleaving writes, and read-modify-writes re-read
+    their record (get_fresh) so they never build on a stale copy.
+
+    Every mutation is stamped with a monotonically increasing change version
+    (microseconds, bumped past the previous one) and appended to a bounded
+    change log, so clients can ask for just what changed since a version.
+    Versions older than the log's floor (process start, a reset, or trimmed
+    history) get a full resync instead. Values derived from the whole record
+    set are cached against the version, so any mutation invalidates them.
+    """
+
+    CHANGE_LOG_LIMIT = 5000
+
+    def __init__(self, athlete_id, plan):
+        self.athlete_id = athlete_id
+        self._lock = threading.RLock()
+        self._data = None
+        self._stats = TrainingStats(plan)
+        self._version = 0
+        self._floor = 0
+        self._change_versions = []
+        self._change_keys = []
+        self._changed = threading.Condition(self._lock)
+        self._derived = {}
+
+    def _ensure_loaded(self):
+        if self._data is None:
+            self._data = self._backend_load_all()
+            self._stats.rebuild(self._data)
+            self._reset_change_log()
+        return self._data
+
+    def _next_version(self):
+        self._version = max(self._version + 1, time.time_ns() // 1000)
+        return self._version
+
+    def _reset_change_log(self):
+        self._floor = self._next_version()
+        self._change_versions = []
+        self._change_keys = []
+
+    def _log_change(self, key):
+        self._change_versions.append(self._next_version())
+        self._change_keys.append(key)
+        if len(self._change_versions) > self.CHANGE_LOG_LIMIT:
+            cut = len(self._change_versions) // 2
+            self._floor = self._change_versions[cut - 1]
+            del self._change_versions[:cut]
+            del self._change_keys[:cut]
+
+    def all(self):
+        """Return a copy of every workout record"""
+        with self._lock:
+            try:
+                return copy.deepcopy(self._ensure_loaded())
+            except Exception as e:
+                logger.error('Error loading workout data', extra={'athlete_id': self.athlete_id, 'error': str(e)})
+                return {}
+
+    def get(self, key):
+        """Return a copy of one workout record, or None"""
+        with self._lock:
+            try:
+                record = self._ensure_loaded().get(key)
+            except Exception as e:
+                logger.error('Error loading workout data', extra={'athlete_id': self.athlete_id, 'error': str(e)})
+                return None
+            return copy.deepcopy(record) if record is not None else None
+
+    def get_fresh(self, key):
+        """Like get, but re-read the record from the backend first.
+
+        Use it (under locked()) for read-modify-writes, so a change saved by
+        another instance since this one loaded isn't overwritten with the
+        stale in-memory copy.
+        """
+        with self._lock:
+            try:
+                current = self._ensure_loaded()
+                with storage_timer('workouts', 'get'):
+                    record = storage.get(self.athlete_id, 'workouts', key)
+            except Exception as e:
+                logger.error('Error loading workout data', extra={'athlete_id': self.athlete_id, 'error': str(e)})
+                return None
+            if record != current.get(key):
+                if record is None:
+                    current.pop(key, None)
+                else:
+                    current[key] = record
+                self._stats.update(key, record)
+                self._log_change(key)
+                self._changed.notify_all()
+            return copy.deepcopy(record) if record is not None else None
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold the store lock across a read-modify-write (get, then put/apply)"""
+        with self._lock:
+            yield self
+
+    def put(self, key, data):
+        """Write one workout record through to the backend"""
+        return self.apply([(key, data)])
+
+    def delete(self, key):
+        """Delete one workout record from the backend"""
+        return self.apply([(key, None)])
+
+    def put_many(self, records):
+        """Write several workout records through in one backend batch"""
+        return self.apply(list(records.items()))
+
+    def apply(self, changes):
+        """Write (key, record) changes through in one batch; a None record deletes the key"""
+        with self._lock:
+            try:
+                current = self._ensure_loaded()
+                self._backend_apply(changes, current)
+            except Exception as e:
+                logger.error('Error saving workout data', extra={'athlete_id': self.athlete_id, 'error': str(e)})
+                return False
+            for key, data in changes:
+                if data is None:
+                    current.pop(key, None)
+                    self._stats.update(key, None)
+                else:
+                    current[key] = copy.deepcopy(data)
+                    self._stats.update(key, current[key])
+                self._log_change(key)
+            self._changed.notify_all()
+            return True
+
+    def clear(self):
+        """Delete every workout record, returning how many were removed"""
+        with self._lock:
+            deleted_count = self._backend_clear()
+            self._data = {}
+            self._stats.rebuild(self._data)
+            self._reset_change_log()
+            self._changed.notify_all()
+            return deleted_count
+
+    def snapshot(self):
+        """Return a copy of every record, the matching totals and the change version, taken atomically"""
+        with self._lock:
+            try:
+                data = self._ensure_loaded()
+            except Exception as e:
+                logger.error('Error loading workout data', extra={'athlete_id': self.athlete_id, 'error': str(e)})
+                data = {}
+            return copy.deepcopy(data), self._stats.snapshot(), self._version
+
+    def version(self):
+        """Current change version, without copying any records"""
+        with self._lock:
+            try:
+                self._ensure_loaded()
+            except Exception as e:
+                logger.error('Error loading workout data', extra={'athlete_id': self.athlete_id, 'error': str(e)})
+            return self._version
+
+    def changes_since(self, since, include_stats=False):
+        """Records changed and keys deleted after version `since`.
+
+        Returns a dict with the current version and either a delta
+        (full=False) or, when `since` predates the change log, every record
+        (full=True, the client should replace its copy). With include_stats
+        the matching totals are added under 'stats'.
+        """
+        with self._lock:
+            data = self._ensure_loaded()
+            if since < self._floor:
+                result = {'version': self._version, 'full': True, 'workouts': copy.deepcopy(data), 'deleted': []}
+            else:
+                start = bisect.bisect_right(self._change_versions, since)
+                changed = set(self._change_keys[start:])
+                result = {
+                    'version': self._version,
+                    'full': False,
+                    'workouts': {k: copy.deepcopy(data[k]) for k in changed if k in data},
+                    'deleted': sorted(k for k in changed if k not in data)
+                }
+            if include_stats:
+                result['stats'] = self._stats.snapshot()
+            return result
+
+    def wait_for_change(self, since, timeout):
+        """Block until the version moves past `since` or the timeout passes"""
+        with self._changed:
+            return self._changed.wait_for(lambda: self._version > since, timeout)
+
+    def stats(self):
+        """Return the incrementally maintained training totals"""
+        with self._lock:
+            try:
+                self._ensure_loaded()
+            except Exception as e:
+                logger.error('Error loading workout data', extra={'athlete_id': self.athlete_id, 'error': str(e)})
+            return self._stats.snapshot()
+
+    def derived(self, name, build):
+        """build(records), computed once per change version and cached under `name`"""
+        with self._lock:
+            data = self._ensure_loaded()
+            cached = self._derived.get(name)
+            if cached is None or cached[0] != self._version:
+                cached = self._derived[name] = (self._version, build(data))
+            return cached[1]
+
+    def _backend_load_all(self):
+        with storage_timer('workouts', 'load'):
+            data = storage.load(self.athlete_id, 'workouts')
+        count_storage_records('workouts', 'load', len(data))
+        return data
+
+    def _backend_apply(self, changes, current):
+        # Deleting a record that was never stored is a no-op
+        writes = [('workouts', key, data) for key, data in changes if data is not None or key in current]
+        if not writes:
+            return
+        count_storage_records('workouts', 'write', len(writes))
+        with storage_timer('workouts', 'write'):
+            storage.apply(self.athlete_id, writes)
+        if storage.needs_compaction(self.athlete_id, 'workouts'):
+            job_queue.submit('compact_journal', self.athlete_id, self.compact_journal,
+                             dedupe_key=('compact_journal', 'workouts', self.athlete_id))
+
+    def compact_journal(self):
+        """Fold the local journal into a fresh snapshot; run as a background job"""
+        with self._lock:
+            if self._data is None or not storage.needs_compaction(self.athlete_id, 'workouts'):
+                return False
+            with storage_timer('workouts', 'compact'):
+                return storage.compact(self.athlete_id, 'workouts', self._data)
+
+    def _backend_clear(self):
+        with storage_timer('workouts', 'clear'):
+            return storage.clear(self.athlete_id, 'workouts')
+
+class JsonJournal:
+    """Local key/value storage as a JSON snapshot plus an append-only journal.
+
+    Each save or delete appends one line to the journal and fsyncs it, so a
+    write costs O(1) regardless of how many records are stored. Every
+    `compact_every` entries the full state is written to a temp file and
+    atomically renamed over the snapshot before the journal is truncated.
+    Replaying the journal is idempotent, so a crash at any point leaves a
+    loadable dataset; a torn final line is discarded on load.
+    """
+
+    def __init__(self, snapshot_path, journal_path, compact_every=500):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_every = compact_every
+        self._lock = threading.Lock()
+        self._fh = None
+        self._entries = 0
+
+    def load(self):
+        """Read the snapshot and replay the journal on top of it"""
+        with self._lock:
+            data = {}
+            if os.path.exists(self.snapshot_path):
+                try:
+                    with open(self.snapshot_path, 'r') as f:
+                        data = json.load(f)
+                except ValueError as e:
+                    logger.warning('Ignoring unreadable data file', extra={'path': self.snapshot_path, 'error': str(e)})
+
+            self._entries = 0
+            if os.path.exists(self.journal_path):
+                good_offset = 0
+                with open(self.journal_path, 'rb') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                            self._apply(data, entry)
+                        except (ValueError, KeyError, TypeError):
+                            logger.warning('Discarding torn journal tail', extra={'path': self.journal_path, 'offset': good_offset})
+                            break
+                        good_offset += len(line)
+                        self._entries += 1
+                if good_offset != os.path.getsize(self.journal_path):
+                    with open(self.journal_path, 'r+b') as f:
+                        f.truncate(good_offset)
+            return data
+
+    @staticmethod
+    def _apply(data, entry):
+        if entry['op'] == 'put':
+            data[entry['key']] = entry['data']
+        elif entry['op'] == 'del':
+            data.pop(entry['key'], None)
+        else:
+            raise ValueError(f"Unknown journal op {entry['op']!r}")
+
+    def append(self, entry):
+        """Durably append one journal entry"""
+        self.append_many([entry])
+
+    def append_many(self, entries):
+        """Durably append several journal entries with a single write and fsync"""
+        with self._lock:
+            if self._fh is None:
+                self._fh = open(self.journal_path, 'a')
+            self._fh.write(''.join(json.dumps(e, separators=(',', ':')) + '\n' for e in entries))
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            self._entries += len(entries)
+
+    def needs_compaction(self):
+        return self._entries >= self.compact_every
+
+    def compact(self, all_data):
+        """Fold the journal into a fresh snapshot via write-and-rename"""
+        with self._lock:
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(all_data, f, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            open(self.journal_path, 'w').close()
+            self._entries = 0
+
+
+# ============================================================================
+# STORAGE BACKENDS
+# ============================================================================
+
+SQLITE_PATH = os.getenv('SQLITE_PATH', '/tmp/training.db')
+
+
+class StorageBackend(abc.ABC):
+    """Keyed JSON documents grouped into named collections.
+
+    Collections belong to an athlete (athlete_id=None for the global athlete
+    and plan directories). The stores keep their own in-memory copies and
+    only come here to load a collection and to write changes through.
+    Backends must implement load, apply and clear; the rest have defaults.
+    """
+
+    name = None
+
+    @abc.abstractmethod
+    def load(self, athlete_id, collection):
+        """Every record in a collection as {key: record}"""
+
+    def get(self, athlete_id, collection, key):
+        """One record, or None"""
+        return self.load(athlete_id, collection).get(key)
+
+    def iter_records(self, athlete_id, collection):
+        """Yield (key, record) pairs one at a time, without holding the whole collection where the backend allows"""
+        yield from sorted(self.load(athlete_id, collection).items())
+
+    @abc.abstractmethod
+    def apply(self, athlete_id, writes):
+        """Write (collection, key, record) changes together; a None record deletes the key"""
+
+    @abc.abstractmethod
+    def clear(self, athlete_id, collection):
+        """Delete every record in a collection, returning how many there were"""
+
+    def needs_compaction(self, athlete_id, collection):
+        return False
+
+    def compact(self, athlete_id, collection, records):
+        """Rewrite a log-structured collection from its full contents; False if there is nothing to do"""
+        return False
+
+
+class FirestoreBackend(StorageBackend):
+    """Collections in Firestore.
+
+    The default athlete's collections and the global ones are top-level;
+    other athletes' live under athletes/{athlete_id}/.
+    """
+
+    name = 'firestore'
+
+    def __init__(self, client):
+        self.client = client
+
+    def collection(self, athlete_id, name):
+        if athlete_id in (None, DEFAULT_ATHLETE_ID):
+            return self.client.collection(name)
+        return self.client.collection('athletes').document(athlete_id).collection(name)
+
+    def load(self, athlete_id, collection):
+        return {doc.id: doc.to_dict() for doc in self.collection(athlete_id, collection).stream()}
+
+    def get(self, athlete_id, collection, key):
+        doc = self.collection(athlete_id, collection).document(key).get()
+        return doc.to_dict() if doc.exists else None
+
+    def iter_records(self, athlete_id, collection):
+        # stream() pages through the query lazily
+        for doc in self.collection(athlete_id, collection).stream():
+            yield doc.id, doc.to_dict()
+
+    def apply(self, athlete_id, writes):
+        writes = list(writes)
+        if len(writes) == 1:
+            collection, key, record = writes[0]
+            ref = self.collection(athlete_id, collection).document(key)
+            if record is None:
+                ref.delete()
+            else:
+                ref.set(record)
+            return
+        self.commit(
+            ('delete', ref, None) if record is None else ('set', ref, record)
+            for ref, record in (
+                (self.collection(athlete_id, collection).document(key), record)
+                for collection, key, record in writes
+            )
+        )
+
+    def clear(self, athlete_id, collection):
+        # list_documents() returns references only, so nothing is read per document
+        refs = list(self.collection(athlete_id, collection).list_documents())
+        self.commit(('delete', ref, None) for ref in refs)
+        return len(refs)
+
+    def commit(self, operations):
+        """Commit ('set'|'delete', doc_ref, data) writes in batches of FIRESTORE_BATCH_LIMIT.
+
+        Each batch is atomic on its own; a failure part way through leaves the
+        earlier batches applied.
+        """
+        batch, pending = self.client.batch(), 0
+        for op, ref, data in operations:
+            if op == 'set':
+                batch.set(ref, data)
+            else:
+                batch.delete(ref)
+            pending += 1
+            if pending == FIRESTORE_BATCH_LIMIT:
+                batch.commit()
+                batch, pending = self.client.batch(), 0
+        if pending:
+            batch.commit()
+
+
+class JsonBackend(StorageBackend):
+    """Collections in local files, each a JsonJournal (snapshot plus journal).
+
+    The default athlete's collections and the global ones keep the original
+    file paths; other athletes' files get an .{athlete_id} suffix. Each
+    snapshot is a single JSON document, so iter_records reads it whole.
+    """
+
+    name = 'json'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._journals = {}
+
+    @staticmethod
+    def _paths(collection):
+        # (snapshot, journal, compact_every) for the default athlete
+        if collection == 'workouts':
+            return DATA_FILE, JOURNAL_FILE, JOURNAL_COMPACT_EVERY
+        path = {
+            'athletes': ATHLETES_FILE,
+            'plans': PLANS_FILE,
+            'strava_activities': STRAVA_ACTIVITIES_FILE,
+            'strava_activity_days': STRAVA_CACHE_DAYS_FILE,
+            'strava_tokens': STRAVA_TOKEN_FILE,
+            'strava_owners': STRAVA_OWNERS_FILE
+        }[collection]
+        return path, path + '.journal', 500
+
+    def journal(self, athlete_id, collection):
+        key = (athlete_id, collection)
+        journal = self._journals.get(key)
+        if journal is None:
+            with self._lock:
+                journal = self._journals.get(key)
+                if journal is None:
+                    snapshot_path, journal_path, compact_every = self._paths(collection)
+                    if athlete_id not in (None, DEFAULT_ATHLETE_ID):
+                        snapshot_path = athlete_file(athlete_id, snapshot_path)
+                        journal_path = snapshot_path + '.journal'
+                    journal = self._journals[key] = JsonJournal(snapshot_path, journal_path, compact_every)
+        return journal
+
+    def load(self, athlete_id, collection):
+        return self.journal(athlete_id, collection).load()
+
+    def apply(self, athlete_id, writes):
+        entries = {}
+        for collection, key, record in writes:
+            entries.setdefault(collection, []).append(
+                {'op': 'del', 'key': key} if record is None else {'op': 'put', 'key': key, 'data': record}
+            )
+        for collection, collection_entries in entries.items():
+            self.journal(athlete_id, collection).append_many(collection_entries)
+
+    def clear(self, athlete_id, collection):
+        journal = self.journal(athlete_id, collection)
+        count = len(journal.load())
+        # Writes an empty snapshot via temp file + rename, then truncates the journal
+        journal.compact({})
+        return count
+
+    def needs_compaction(self, athlete_id, collection):
+        return self.journal(athlete_id, collection).needs_compaction()
+
+    def compact(self, athlete_id, collection, records):
+        self.journal(athlete_id, collection).compact(records)
+        return True
+
+
+class SqliteBackend(StorageBackend):
+    """Collections in one SQLite database in WAL mode.
+
+    Each record is a row keyed by (athlete_id, collection, key) holding the
+    JSON document, so loading a collection or reading one record is a
+    primary-key range or lookup. WAL lets readers carry on while a write
+    commits, and each thread keeps its own connection.
+    """
+
+    name = 'sqlite'
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS records (
+            athlete_id TEXT NOT NULL,
+            collection TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (athlete_id, collection, key)
+        ) WITHOUT ROWID;
+        -- Nothing queried these; older databases still carry them
+        DROP INDEX IF EXISTS records_by_week;
+        DROP INDEX IF EXISTS records_by_date;
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(self.SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA synchronous=FULL')
+        return conn
+
+    def load(self, athlete_id, collection):
+        rows = self._connection().execute(
+            'SELECT key, data FROM records WHERE athlete_id = ? AND collection = ?',
+            (athlete_id or '', collection)
+        )
+        return {key: json.loads(data) for key, data in rows}
+
+    def iter_records(self, athlete_id, collection):
+        cursor = self._connection().execute(
+            'SELECT key, data FROM records WHERE athlete_id = ? AND collection = ? ORDER BY key',
+            (athlete_id or '', collection)
+        )
+        try:
+            for key, data in cursor:
+                yield key, json.loads(data)
+        finally:
+            cursor.close()
+
+    def get(self, athlete_id, collection, key):
+        row = self._connection().execute(
+            'SELECT data FROM records WHERE athlete_id = ? AND collection = ? AND key = ?',
+            (athlete_id or '', collection, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def apply(self, athlete_id, writes):
+        scope = athlete_id or ''
+        statements = []
+        for collection, key, record in writes:
+            if record is None:
+                statements.append((
+                    'DELETE FROM records WHERE athlete_id = ? AND collection = ? AND key = ?',
+                    (scope, collection, key)
+                ))
+            else:
+                statements.append((
+                    'INSERT OR REPLACE INTO records (athlete_id, collection, key, data) VALUES (?, ?, ?, ?)',
+                    (scope, collection, key, json.dumps(record, separators=(',', ':')))
+                ))
+        conn = self._connection()
+        with conn:
+            for sql, params in statements:
+                conn.execute(sql, params)
+
+    def clear(self, athlete_id, collection):
+        conn = self._connection()
+        with conn:
+            return conn.execute(
+                'DELETE FROM records WHERE athlete_id = ? AND collection = ?', (athlete_id or '', collection)
+            ).rowcount
+
+
+def create_firestore_client():
+    # Imported here: google-cloud-firestore pulls in grpc and protobuf
+    from google.cloud import firestore
+    return firestore.Client()
+
+
+def create_storage_backend(name):
+    """The backend STORAGE_BACKEND names (unset: Firestore if a client can be created, else json)"""
+    if name and name not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown STORAGE_BACKEND {name!r}; use firestore, json or sqlite")
+    backend = None
+    if name == 'firestore':
+        backend = FirestoreBackend(create_firestore_client())
+    elif not name:
+        try:
+            backend = FirestoreBackend(create_firestore_client())
+        except Exception as e:
+            logger.warning('Firestore not available, using local storage', extra={'error': str(e)})
+    if backend is None:
+        backend = SqliteBackend(SQLITE_PATH) if name == 'sqlite' else JsonBackend()
+    logger.info('Storage backend selected', extra={'backend': backend.name})
+    return backend
+
+
+# A misspelt backend should still fail at startup, not on the first request
+if STORAGE_BACKEND and STORAGE_BACKEND not in STORAGE_BACKENDS:
+    raise ValueError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}; use firestore, json or sqlite")
+storage = LazyComponent('storage', lambda: create_storage_backend(STORAGE_BACKEND))
+
+
+# ============================================================================
+# PLAN GENERATOR
+# ============================================================================
+
+METERS_PER_MILE = 1609.344
+MARATHON_METERS = 42195
+PLAN_PACE_KEYS = ('easy', 'marathon', 'threshold', 'interval', 'race')
+PLAN_QUALITY_WORKOUTS = ('easy', 'strides', 'tempo', 'intervals', 'race_pace')
+PLAN_MAX_WEEKS = 52
+PLAN_GENERATOR_CACHE_SIZE = 64
+
+
+def _vo2_velocity(vo2):
+    """Running speed (m/min) whose oxygen cost is `vo2` ml/kg/min (Daniels & Gilbert)"""
+    a, b, c = 0.000104, 0.182258, -(4.60 + vo2)
+    return (-b + math.sqrt(b * b - 4 * a * c)) / (2 * a)
+
+
+def _race_minutes(vdot, meters):
+    """Predicted race time in minutes for a VDOT, solved by bisection"""
+    lo, hi = 1.0, 1000.0
+    for _ in range(50):
+        t = (lo + hi) / 2
+        v = meters / t
+        fraction = 0.8 + 0.1894393 * math.exp(-0.012778 * t) + 0.2989558 * math.exp(-0.1932605 * t)
+        if (-4.60 + 0.182258 * v + 0.000104 * v * v) / fraction > vdot:
+            lo = t
+        else:
+            hi = t
+    return hi
+
+
+def _mile_pace(meters_per_min):
+    seconds = round(METERS_PER_MILE / meters_per_min * 60)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def vdot_paces(vdot, race_miles):
+    """Training pace ranges (min/mile) for a VDOT, matching Daniels' tables"""
+    race_meters = race_miles * METERS_PER_MILE
+
+    def pace_range(speed):
+        return f"{_mile_pace(speed(vdot + 0.5))}-{_mile_pace(speed(vdot - 0.5))}"
+
+    return {
+        'easy': f"{_mile_pace(_vo2_velocity(vdot * 0.74))}-{_mile_pace(_vo2_velocity(vdot * 0.65))}",
+        'marathon': pace_range(lambda x: MARATHON_METERS / _race_minutes(x, MARATHON_METERS)),
+        'threshold': pace_range(lambda x: _vo2_velocity(x * 0.88)),
+        'interval': pace_range(lambda x: _vo2_velocity(x * 0.975)),
+        'race': pace_range(lambda x: race_meters / _race_minutes(x, race_meters))
+    }
+
+
+def normalize_plan_params(params):
+    """Validate generator parameters and fill in defaults, raising ValueError.
+
+    {"race_name", "race_date", "start_date", "race_miles" (13.1),
+     "weekly_miles": [one total per week], "vdot",
+     "phases": [{"name", "through_week", "quality"}], "paces": {overrides},
+     "goal", "cycle_day" (0-2, where start_date falls in the 2-on/1-off cycle)}
+    """
+    if not isinstance(params, dict):
+        raise ValueError('params must be an object')
+    try:
+        race = date.fromisoformat(params.get('race_date', ''))
+        start = date.fromisoformat(params.get('start_date', ''))
+    except (TypeError, ValueError):
+        raise ValueError('race_date and start_date must be YYYY-MM-DD')
+    if start >= race:
+        raise ValueError('start_date must be before race_date')
+    # The plan runs from start_date through the rest day after the race
+    num_weeks = math.ceil(((race - start).days + 2) / 7)
+    if num_weeks > PLAN_MAX_WEEKS:
+        raise ValueError(f'plans can be at most {PLAN_MAX_WEEKS} weeks')
+    
+    race_miles = params.get('race_miles', 13.1)
+    if not isinstance(race_miles, (int, float)) or not 0 < race_miles <= 100:
+        raise ValueError('race_miles must be a number of miles')
+    weekly_miles = params.get('weekly_miles')
+    if (not isinstance(weekly_miles, list) or len(weekly_miles) != num_weeks or
+            not all(isinstance(m, (int, float)) and 0 <= m <= 200 for m in weekly_miles)):
+        raise ValueError(f'weekly_miles must list {num_weeks} weekly totals between 0 and 200')
+    vdot = params.get('vdot')
+    if not isinstance(vdot, (int, float)) or not 20 <= vdot <= 85:
+        raise ValueError('vdot must be a number between 20 and 85')
+    
+    phases = params.get('phases') or [{'name': 'TRAINING', 'through_week': max(num_weeks - 1, 1), 'quality': 'tempo'}]
+    last_week = 0
+    for phase in phases:
+        if (not isinstance(phase, dict) or not isinstance(phase.get('name'), str) or
+                not isinstance(phase.get('through_week'), int)):
+            raise ValueError('phases need a name and an integer through_week')
+        if not last_week < phase['through_week'] <= num_weeks:
+            raise ValueError('phase through_week values must increase and stay within the plan')
+        if phase.get('quality', 'easy') not in PLAN_QUALITY_WORKOUTS:
+            raise ValueError(f"phase quality must be one of {', '.join(PLAN_QUALITY_WORKOUTS)}")
+        last_week = phase['through_week']
+    
+    paces = params.get('paces') or {}
+    if not isinstance(paces, dict) or not all(
+            k in PLAN_PACE_KEYS and isinstance(v, str) and PLAN_PACE_RANGE_RE.match(v) for k, v in paces.items()):
+        raise ValueError(f"paces may only override {', '.join(PLAN_PACE_KEYS)} with \"m:ss-m:ss\" ranges")
+    cycle_day = params.get('cycle_day', 0)
+    if cycle_day not in (0, 1, 2):
+        raise ValueError('cycle_day must be 0, 1 or 2')
+    
+    return {
+        'race_name': str(params.get('race_name') or 'Goal Race'),
+        'race_date': race.isoformat(),
+        'start_date': start.isoformat(),
+        'race_miles': race_miles,
+        'weekly_miles': weekly_miles,
+        'vdot': vdot,
+        'phases': [
+            {'name': p['name'], 'through_week': p['through_week'], 'quality': p.get('quality', 'easy')}
+            for p in phases
+        ],
+        'paces': paces,
+        'goal': params.get('goal'),
+        'cycle_day': cycle_day
+    }
+
+
+def _split_week_miles(total, runs, long_run):
+    """Whole miles for each run of a week; with long_run the last run gets ~30%"""
+    total = int(round(total))
+    if runs == 0:
+        return []
+    if long_run and runs >= 3:
+        long_miles = round(total * 0.3)
+        return _split_week_miles(total - long_miles, runs - 1, False) + [long_miles]
+    share, extra = divmod(total, runs)
+    return [share + (1 if i < extra else 0) for i in range(runs)]
+
+
+def _quality_workout(quality, miles, paces):
+    if quality == 'strides':
+        return f"{miles} mi Easy + 6 strides"
+    if quality == 'tempo':
+        return f"{miles} mi Tempo (2 mi WU + {miles - 3} mi @ {paces['threshold']} + 1 mi CD)"
+    if quality == 'intervals':
+        return f"{miles} mi w/ {miles - 3}x1 mi @ {paces['interval']} (2 mi WU + intervals w/ 2 min rest + 1 mi CD)"
+    if quality == 'race_pace':
+        return f"{miles} mi w/ {miles - 3} mi @ {paces['race']} (2 mi WU + 1 mi CD)"
+    return f"{miles} mi Easy"
+
+
+def generate_plan(params):
+    """Build a plan shaped like TRAINING_PLAN from normalized generator parameters.
+
+    Days follow the continuous 2-on/1-off cycle from start_date. Each week's
+    mileage is split over its run days, with the long run last and the
+    phase's quality session first; the day before the race is a rest day.
+    """
+    start = date.fromisoformat(params['start_date'])
+    race = date.fromisoformat(params['race_date'])
+    paces = {**vdot_paces(params['vdot'], params['race_miles']), **params['paces']}
+    race_minutes = _race_minutes(params['vdot'], params['race_miles'] * METERS_PER_MILE)
+    race_seconds = round(race_minutes * 60)
+    
+    weeks = []
+    for week_idx, week_target in enumerate(params['weekly_miles']):
+        days = [start + timedelta(days=week_idx * 7 + i) for i in range(7)]
+        days = [day for day in days if day <= race + timedelta(days=1)]
+        race_week = race in days
+        phase = next(
+            (p for p in params['phases'] if week_idx < p['through_week']),
+            {'name': 'RACE WEEK', 'quality': 'easy'}
+        )
+        day_types = [
+            'RACE' if day == race else
+            'REST' if day > race else
+            f"DAY {((day - start).days + params['cycle_day']) % 3 + 1}"
+            for day in days
+        ]
+        run_idxs = [
+            i for i, (day, day_type) in enumerate(zip(days, day_types))
+            if day_type in ('DAY 1', 'DAY 2') and day != race - timedelta(days=1)
+        ]
+        target = week_target - params['race_miles'] if race_week else week_target
+        run_miles = dict(zip(run_idxs, _split_week_miles(max(target, 0), len(run_idxs), not race_week)))
+        
+        workouts = []
+        for i, (day, day_type) in enumerate(zip(days, day_types)):
+            miles = run_miles.get(i, 0)
+            if day_type == 'RACE':
+                miles = params['race_miles']
+                text = f"RACE DAY! {miles:g} miles - {params['race_name'].upper()}"
+            elif day > race:
+                text = 'REST & CELEBRATE!'
+            elif day == race - timedelta(days=1):
+                text = 'REST (complete rest before race)'
+            elif miles == 0:
+                text = 'REST'
+            elif not race_week and len(run_idxs) >= 3 and i == run_idxs[-1]:
+                text = f"{miles} mi Long Run Easy ({paces['easy']})"
+            elif i == run_idxs[0] and miles >= 4 and not race_week:
+                text = _quality_workout(phase['quality'], miles, paces)
+            else:
+                text = f"{miles} mi Easy"
+            workouts.append({
+                'day': f"{day:%a} {day.month}/{day.day}",
+                'workout': text,
+                'day_type': day_type,
+                'miles': miles
             })
         
-        # Success page that closes popup
-        return '''
+        first, last = days[0], days[-1]
+        weeks.append({
+            'week_num': week_idx + 1,
+            'dates': f"{first:%b} {first.day}-" + (f"{last.day}" if first.month == last.month else f"{last:%b} {last.day}"),
+            'total_miles': round(sum(w['miles'] for w in workouts), 1),
+            'num_runs': sum(1 for w in workouts if w['miles'] > 0),
+            'phase': phase['name'],
+            'workouts': workouts
+        })
+    
+    return {
+        'race_date': params['race_date'],
+        'goal': params['goal'] or (
+            f"{race_seconds // 3600}:{race_seconds // 60 % 60:02d}:{race_seconds % 60:02d} "
+            f"({_mile_pace(params['race_miles'] * METERS_PER_MILE / race_minutes)}/mile pace)"
+        ),
+        'race_name': params['race_name'],
+        'paces': paces,
+        'generator': params,
+        'weeks': weeks
+    }
+
+
+def _params_key(params):
+    return json.dumps(params, sort_keys=True, separators=(',', ':'))
+
+
+@functools.lru_cache(maxsize=PLAN_GENERATOR_CACHE_SIZE)
+def _generated_plan_info(params_key):
+    plan_id = 'gen-' + hashlib.sha256(params_key.encode('utf-8')).hexdigest()[:16]
+    return PlanInfo(plan_id, generate_plan(json.loads(params_key)))
+
+
+def generated_plan(params):
+    """PlanInfo for generator parameters, built once per distinct parameter set"""
+    return _generated_plan_info(_params_key(normalize_plan_params(params)))
+
+
+# ============================================================================
+# ATHLETES AND PLANS
+# ============================================================================
+
+ATHLETES_FILE = os.getenv('ATHLETES_FILE', '/tmp/athletes.json')
+PLANS_FILE = os.getenv('PLANS_FILE', '/tmp/plans.json')
+
+
+class Directory:
+    """Small keyed collection (athlete profiles, stored plans) loaded once.
+
+    Backed by a global (not per-athlete) collection in the storage backend.
+    A key missing from the loaded copy is looked up in the backend before
+    answering None, so entries created by other instances are found.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._items = None
+
+    def _ensure_loaded(self):
+        if self._items is None:
+            with storage_timer(self.collection, 'load'):
+                self._items = storage.load(None, self.collection)
+            count_storage_records(self.collection, 'load', len(self._items))
+        return self._items
+
+    def get(self, key):
+        with self._lock:
+            items = self._ensure_loaded()
+            item = items.get(key)
+            if item is None:
+                # Another instance may have created it since this one loaded
+                with storage_timer(self.collection, 'get'):
+                    item = storage.get(None, self.collection, key)
+                if item is not None:
+                    items[key] = dict(item)
+            return dict(item) if item is not None else None
+
+    def all(self):
+        with self._lock:
+            return {k: dict(v) for k, v in self._ensure_loaded().items()}
+
+    def put(self, key, item):
+        with self._lock:
+            items = self._ensure_loaded()
+            count_storage_records(self.collection, 'write', 1)
+            with storage_timer(self.collection, 'write'):
+                storage.apply(None, [(self.collection, key, item)])
+            items[key] = dict(item)
+
+    def delete(self, key):
+        with self._lock:
+            items = self._ensure_loaded()
+            count_storage_records(self.collection, 'write', 1)
+            with storage_timer(self.collection, 'write'):
+                storage.apply(None, [(self.collection, key, None)])
+            items.pop(key, None)
+
+
+athlete_directory = Directory('athletes')
+plan_directory = Directory('plans')
+
+_registry_lock = threading.RLock()
+_plan_infos = {DEFAULT_PLAN_ID: PlanInfo(DEFAULT_PLAN_ID, TRAINING_PLAN)}
+_workout_stores = {}
+
+
+class AthleteNotFound(Exception):
+    """The request names an athlete that is not registered"""
+
+
+def _per_athlete(registry, athlete_id, factory):
+    """Get or lazily create the per-athlete instance held in `registry`"""
+    instance = registry.get(athlete_id)
+    if instance is None:
+        with _registry_lock:
+            instance = registry.get(athlete_id)
+            if instance is None:
+                instance = registry[athlete_id] = factory(athlete_id)
+    return instance
+
+
+def get_plan_info(plan_id):
+    """PlanInfo for a built-in or stored plan (None if unknown), built once per plan"""
+    info = _plan_infos.get(plan_id)
+    if info is None:
+        plan = plan_directory.get(plan_id)
+        if plan is None:
+            return None
+        try:
+            info = PlanInfo(plan_id, plan)
+        except Exception as e:
+            # A plan stored before validation caught its problem is treated
+            # as unknown rather than failing every request that lists plans
+            logger.error('Stored plan cannot be compiled', extra={'plan_id': plan_id, 'error': str(e)})
+            return None
+        with _registry_lock:
+            info = _plan_infos.setdefault(plan_id, info)
+    return info
+
+
+def get_athlete(athlete_id):
+    """Profile for an athlete, or None if unknown (the default athlete always exists)"""
+    # The default athlete can't be registered, so answering it needs no
+    # storage read (and / or /api/get_plan on a cold start builds no backend)
+    if athlete_id == DEFAULT_ATHLETE_ID:
+        return {'name': 'Default athlete', 'plan_id': DEFAULT_PLAN_ID}
+    return athlete_directory.get(athlete_id)
+
+
+def athlete_plan(athlete_id):
+    """PlanInfo for the plan an athlete follows"""
+    profile = get_athlete(athlete_id) or {}
+    return get_plan_info(profile.get('plan_id', DEFAULT_PLAN_ID)) or _plan_infos[DEFAULT_PLAN_ID]
+
+
+def get_workout_store(athlete_id):
+    """The WorkoutStore holding one athlete's workouts"""
+    return _per_athlete(
+        _workout_stores, athlete_id,
+        lambda a: WorkoutStore(a, athlete_plan(a))
+    )
+
+
+def current_athlete_id():
+    """Athlete for this request: X-Athlete-Id header, ?athlete=, the athlete_id cookie, else the default"""
+    athlete_id = (
+        request.headers.get('X-Athlete-Id') or request.args.get('athlete') or
+        request.cookies.get('athlete_id') or DEFAULT_ATHLETE_ID
+    )
+    if not ATHLETE_ID_RE.match(athlete_id) or get_athlete(athlete_id) is None:
+        raise AthleteNotFound(athlete_id)
+    return athlete_id
+
+
+def current_store():
+    return get_workout_store(current_athlete_id())
+
+
+def current_plan():
+    return athlete_plan(current_athlete_id())
+
+
+@app.errorhandler(AthleteNotFound)
+def athlete_not_found(e):
+    return jsonify({'success': False, 'error': f'Unknown athlete: {e}'}), 404
+
+
+def load_workout_data():
+    """Load saved workout completion data"""
+    return current_store().all()
+
+def save_workout_data(key, data):
+    """Save workout completion data"""
+    return current_store().put(key, data)
+
+def cached_response(body, etag, mimetype, max_age=0, private=False):
+    """Build a response for a precomputed body, answering 304 on If-None-Match.
+
+    Pass private=True for per-athlete bodies so shared caches don't mix them up.
+    """
+    response = app.response_class(body, mimetype=mimetype)
+    response.set_etag(etag)
+    if private:
+        response.cache_control.private = True
+        response.vary.update(['Cookie', 'X-Athlete-Id'])
+    else:
+        response.cache_control.public = True
+    if max_age:
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+_index_page = None
+
+@app.route('/')
+def index():
+    """Main page showing the full training plan"""
+    # All data is fetched via API endpoints, so the page renders the same every
+    # time; render it once and let browsers revalidate with the ETag
+    global _index_page
+    if _index_page is None or app.debug:
+        html = render_template('index.html')
+        _index_page = (html, hashlib.sha256(html.encode('utf-8')).hexdigest()[:32])
+    html, etag = _index_page
+    response = cached_response(html, etag, 'text/html')
+    
+    # /?athlete=<id> selects the athlete for every API call this browser makes
+    athlete_id = request.args.get('athlete')
+    if athlete_id:
+        if not ATHLETE_ID_RE.match(athlete_id) or get_athlete(athlete_id) is None:
+            raise AthleteNotFound(athlete_id)
+        response.set_cookie('athlete_id', athlete_id, samesite='Lax')
+    return response
+
+
+def is_empty_log(data):
+    """True when a log payload has no actual workout data (no miles and no notes)"""
+    actual_miles = str(data.get('actual_miles') or '').strip()
+    notes = data.get('notes', '') or ''
+    return (not actual_miles or float(actual_miles) == 0) and not notes.strip()
+
+def logged_workout(workout_info, data):
+    """Apply a log_workout payload to a record (preserves existing edit data)"""
+    workout_info.update({
+        'completed': data.get('completed', False),
+        'notes': data.get('notes', ''),
+        'actual_miles': data.get('actual_miles', ''),
+        'actual_pace': data.get('actual_pace', ''),
+        'duration': data.get('duration', ''),
+        'date_logged': datetime.now().isoformat()
+    })
+    
+    # Add Strava data if present
+    if data.get('strava_data'):
+        workout_info['strava_data'] = data['strava_data']
+    return workout_info
+
+def edited_workout(workout_info, data):
+    """Apply an edit_workout payload to a record"""
+    workout_info.update({
+        'is_modified': True,
+        'original_workout': data.get('original_workout'),
+        'original_miles': data.get('original_miles'),
+        'modified_workout': data.get('modified_workout'),
+        'modified_miles': data.get('modified_miles'),
+        'modified_type': data.get('modified_type'),
+        'modification_reason': data.get('modification_reason', ''),
+        'modified_date': datetime.now().isoformat()
+    })
+    return workout_info
+
+def reverted_workout(workout_info):
+    """Remove modification flags from a record but keep completion status"""
+    workout_info['is_modified'] = False
+    workout_info.pop('modified_workout', None)
+    workout_info.pop('modified_miles', None)
+    workout_info.pop('modified_type', None)
+    workout_info.pop('modification_reason', None)
+    workout_info.pop('modified_date', None)
+    return workout_info
+
+
+@app.route('/api/log_workout', methods=['POST'])
+def log_workout():
+    """Log a workout as completed"""
+    data = request.json
+    key = f"w{data.get('week')}_d{data.get('day')}"
+    
+    store = current_store()
+    
+    # If effectively empty (no actual workout data), delete the record instead of saving
+    if is_empty_log(data):
+        if store.delete(key):
+            return jsonify({'success': True, 'deleted': True, 'message': 'Workout data cleared'})
+        return jsonify({'success': False, 'error': 'Failed to delete workout'}), 500
+    
+    # Load existing record to preserve edit information
+    with store.locked():
+        workout_info = logged_workout(store.get_fresh(key) or {}, data)
+        success = store.put(key, workout_info)
+    
+    if success:
+        return jsonify({'success': True, 'data': workout_info})
+    else:
+        return jsonify({'success': False, 'error': 'Failed to save workout'}), 500
+
+@app.route('/api/edit_workout', methods=['POST'])
+def edit_workout():
+    """Edit/modify a planned workout"""
+    data = request.json
+    key = f"w{data.get('week')}_d{data.get('day')}"
+    
+    # Load existing record or create new
+    store = current_store()
+    with store.locked():
+        workout_info = edited_workout(store.get_fresh(key) or {}, data)
+        success = store.put(key, workout_info)
+    
+    if success:
+        return jsonify({'success': True, 'data': workout_info})
+    else:
+        return jsonify({'success': False, 'error': 'Failed to save modification'}), 500
+
+@app.route('/api/revert_workout', methods=['POST'])
+def revert_workout():
+    """Revert a modified workout back to original"""
+    data = request.json
+    key = f"w{data.get('week')}_d{data.get('day')}"
+    
+    # Load existing record
+    store = current_store()
+    with store.locked():
+        workout_info = store.get_fresh(key)
+        if workout_info is not None:
+            workout_info = reverted_workout(workout_info)
+            success = store.put(key, workout_info)
+    
+    if workout_info is not None:
+        if success:
+            return jsonify({'success': True, 'data': workout_info})
+        else:
+            return jsonify({'success': False, 'error': 'Failed to revert'}), 500
+    
+    return jsonify({'success': False, 'error': 'Workout not found'}), 404
+
+BATCH_MAX_OPERATIONS = 200
+
+def _validate_batch_operation(op):
+    """Return (key, error) for one batch operation"""
+    if not isinstance(op, dict):
+        return None, 'operation must be an object'
+    if op.get('op') not in ('log', 'edit', 'revert'):
+        return None, "op must be one of 'log', 'edit', 'revert'"
+    week, day = op.get('week'), op.get('day')
+    if not isinstance(week, int) or isinstance(week, bool) or not isinstance(day, int) or isinstance(day, bool):
+        return None, 'week and day must be integers'
+    if op['op'] == 'log':
+        if not isinstance(op.get('notes') or '', str):
+            return None, 'notes must be a string'
+        try:
+            is_empty_log(op)
+        except (TypeError, ValueError):
+            return None, 'actual_miles must be a number'
+    return f"w{week}_d{day}", None
+
+@app.route('/api/batch_workouts', methods=['POST'])
+def batch_workouts():
+    """Apply many log/edit/revert operations in one storage batch.
+
+    Body: {"operations": [{"op": "log"|"edit"|"revert", "week": 1, "day": 0, ...}]}
+    where the remaining fields are the same as for the single-workout endpoints.
+    Operations apply in order (several may target the same workout); invalid
+    ones are reported and skipped, the rest are saved together.
+    """
+    operations = (request.get_json(silent=True) or {}).get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'success': False, 'error': 'operations must be a non-empty list'}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({'success': False, 'error': f'at most {BATCH_MAX_OPERATIONS} operations per batch'}), 400
+    
+    store = current_store()
+    results = []
+    working = {}
+    # Reads and the final write happen under the store lock, so a concurrent
+    # batch or single-workout call can't slip in between and be overwritten
+    with store.locked():
+        for index, op in enumerate(operations):
+            key, error = _validate_batch_operation(op)
+            if error:
+                results.append({'index': index, 'success': False, 'error': error})
+                continue
+            
+            workout_info = working[key] if key in working else store.get_fresh(key)
+            if op['op'] == 'log':
+                if is_empty_log(op):
+                    working[key] = None
+                    results.append({'index': index, 'key': key, 'success': True, 'deleted': True})
+                    continue
+                workout_info = logged_workout(workout_info or {}, op)
+            elif op['op'] == 'edit':
+                workout_info = edited_workout(workout_info or {}, op)
+            elif workout_info is None:
+                results.append({'index': index, 'key': key, 'success': False, 'error': 'Workout not found'})
+                continue
+            else:
+                workout_info = reverted_workout(workout_info)
+            working[key] = workout_info
+            results.append({'index': index, 'key': key, 'success': True, 'data': copy.deepcopy(workout_info)})
+        
+        if working and not store.apply(list(working.items())):
+            return jsonify({'success': False, 'error': 'Failed to save workouts'}), 500
+    
+    return jsonify({
+        'success': all(r['success'] for r in results),
+        'results': results
+    })
+
+def build_stats(stats, plan):
+    """Combine the store's running totals with the plan-wide constants"""
+    total_workouts = plan.total_run_workouts
+    completed_workouts = stats['completed_workouts']
+    return {
+        'total_workouts': total_workouts,
+        'completed_workouts': completed_workouts,
+        'completion_percentage': round((completed_workouts / total_workouts * 100), 1) if total_workouts > 0 else 0,
+        'total_planned_miles': plan.total_planned_miles,
+        'completed_miles': stats['completed_miles'],
+        'weekly_actual_miles': stats['weekly_actual_miles']  # Weekly breakdown for chart
+    }
+
+@app.route('/api/get_stats')
+def get_stats():
+    """Get training statistics"""
+    return jsonify(build_stats(current_store().stats(), current_plan()))
+
+@app.route('/api/get_plan')
+def get_plan():
+    """Get the full training plan"""
+    plan = current_plan()
+    return cached_response(plan.json, plan.etag, 'application/json', max_age=PLAN_CACHE_MAX_AGE, private=True)
+
+@app.route('/api/get_workouts')
+def get_workouts():
+    """Get all workout data, or with ?since=<version> only what changed since then"""
+    since = request.args.get('since')
+    if since is None:
+        return jsonify(load_workout_data())
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({'error': 'since must be an integer change version'}), 400
+    return jsonify(current_store().changes_since(since))
+
+@app.route('/api/bootstrap')
+def bootstrap():
+    """Get the plan, all workout data and stats in one response"""
+    # Workouts and stats come from the same store snapshot, and the plan is
+    # spliced in from its pre-encoded JSON rather than re-serialized
+    athlete_id = current_athlete_id()
+    plan = athlete_plan(athlete_id)
+    workout_data, stats, version = get_workout_store(athlete_id).snapshot()
+    body = (
+        '{"athlete":' + json.dumps(athlete_id) +
+        ',"plan":' + plan.json +
+        ',"version":' + str(version) +
+        ',"workouts":' + json.dumps(workout_data, separators=(',', ':')) +
+        ',"stats":' + json.dumps(build_stats(stats, plan), separators=(',', ':')) +
+        '}'
+    )
+    response = app.response_class(body, mimetype='application/json')
+    response.cache_control.no_store = True
+    return response
+
+# gthread workers hold a thread per open stream, so only a few clients get a
+# live stream at a time; the rest are told to reconnect later and receive the
+# delta then, which degrades them to cheap polling instead of exhausting threads
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', '3'))
+SSE_STREAM_SECONDS = int(os.getenv('SSE_STREAM_SECONDS', '60'))
+SSE_HEARTBEAT_SECONDS = 15
+SSE_RECONNECT_MS = 1000
+SSE_POLL_RETRY_MS = 15000
+_sse_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+def _sse_event(store, plan, since):
+    """Format the workout delta and stats after `since` as an SSE event, or None if nothing changed"""
+    delta = store.changes_since(since, include_stats=True)
+    if not delta['full'] and not delta['workouts'] and not delta['deleted']:
+        return None, since
+    delta['stats'] = build_stats(delta['stats'], plan)
+    payload = json.dumps(delta, separators=(',', ':'))
+    return f"id: {delta['version']}\nevent: workouts\ndata: {payload}\n\n", delta['version']
+
+@app.route('/api/events')
+def events():
+    """Server-sent events stream of workout deltas and updated stats.
+
+    Resumes from the Last-Event-ID header (set by EventSource on reconnect)
+    or ?since=<version>; with neither, starts from the current version.
+    """
+    athlete_id = current_athlete_id()
+    store, plan = get_workout_store(athlete_id), athlete_plan(athlete_id)
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        since = int(since) if since else store.version()
+    except ValueError:
+        return jsonify({'error': 'since must be an integer change version'}), 400
+    
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if not _sse_slots.acquire(blocking=False):
+        event, _ = _sse_event(store, plan, since)
+        body = f"retry: {SSE_POLL_RETRY_MS}\n\n" + (event or '')
+        return app.response_class(body, mimetype='text/event-stream', headers=headers)
+    
+    def stream(since):
+        yield f"retry: {SSE_RECONNECT_MS}\n\n"
+        deadline = time.monotonic() + SSE_STREAM_SECONDS
+        while True:
+            event, since = _sse_event(store, plan, since)
+            if event:
+                yield event
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if not store.wait_for_change(since, min(remaining, SSE_HEARTBEAT_SECONDS)):
+                yield ": keepalive\n\n"
+    
+    # Released when the server closes the response, which also happens when
+    # the generator never starts (HEAD, or a client gone before the first chunk)
+    released = []
+    def release_slot():
+        if not released:
+            released.append(True)
+            _sse_slots.release()
+    
+    response = app.response_class(stream(since), mimetype='text/event-stream', headers=headers)
+    response.call_on_close(release_slot)
+    return response
+
+@app.route('/api/athletes')
+def list_athletes():
+    """List registered athletes and the plan each follows"""
+    profiles = athlete_directory.all()
+    profiles[DEFAULT_ATHLETE_ID] = get_athlete(DEFAULT_ATHLETE_ID)
+    return jsonify({'athletes': [{'athlete_id': k, **v} for k, v in sorted(profiles.items())]})
+
+@app.route('/api/athletes', methods=['POST'])
+def create_athlete():
+    """Register an athlete: {"athlete_id", "name", "plan_id"}"""
+    data = request.get_json(silent=True) or {}
+    athlete_id = data.get('athlete_id', '')
+    plan_id = data.get('plan_id', DEFAULT_PLAN_ID)
+    if not isinstance(athlete_id, str) or not ATHLETE_ID_RE.match(athlete_id):
+        return jsonify({'success': False, 'error': 'athlete_id must be 1-64 letters, digits, _ or -'}), 400
+    if get_athlete(athlete_id) is not None:
+        return jsonify({'success': False, 'error': f'Athlete {athlete_id} already exists'}), 409
+    if get_plan_info(plan_id) is None:
+        return jsonify({'success': False, 'error': f'Unknown plan: {plan_id}'}), 400
+    
+    profile = {
+        'name': data.get('name') or athlete_id,
+        'plan_id': plan_id,
+        'created_at': datetime.now().isoformat()
+    }
+    athlete_directory.put(athlete_id, profile)
+    return jsonify({'success': True, 'athlete': {'athlete_id': athlete_id, **profile}})
+
+@app.route('/api/plans')
+def list_plans():
+    """List available training plans"""
+    plan_ids = {DEFAULT_PLAN_ID, *plan_directory.all()}
+    plans = []
+    for plan_id in sorted(plan_ids):
+        info = get_plan_info(plan_id)
+        if info is None:
+            continue
+        plans.append({
+            'plan_id': plan_id,
+            'race_name': info.plan.get('race_name'),
+            'race_date': info.plan['race_date'],
+            'weeks': info.num_weeks,
+            'total_planned_miles': info.total_planned_miles
+        })
+    return jsonify({'plans': plans})
+
+@app.route('/api/plans', methods=['POST'])
+def create_plan():
+    """Store a new training plan: {"plan_id", "plan"} with plan shaped like TRAINING_PLAN.
+
+    Plans are immutable once stored, since their payloads and ETags are cached.
+    """
+    data = request.get_json(silent=True) or {}
+    plan_id = data.get('plan_id', '')
+    if not isinstance(plan_id, str) or not ATHLETE_ID_RE.match(plan_id):
+        return jsonify({'success': False, 'error': 'plan_id must be 1-64 letters, digits, _ or -'}), 400
+    if get_plan_info(plan_id) is not None:
+        return jsonify({'success': False, 'error': f'Plan {plan_id} already exists'}), 409
+    try:
+        validate_plan(data.get('plan'))
+        # Compile it now, so a plan that passes the shape checks but can't be
+        # laid out on the calendar is refused instead of stored
+        info = PlanInfo(plan_id, data['plan'])
+    except (ValueError, TypeError, KeyError, IndexError, OverflowError) as e:
+        return jsonify({'success': False, 'error': str(e) or type(e).__name__}), 400
+    
+    plan_directory.put(plan_id, data['plan'])
+    with _registry_lock:
+        _plan_infos.setdefault(plan_id, info)
+    return jsonify({'success': True, 'plan_id': plan_id})
+
+@app.route('/api/plans/generate', methods=['POST'])
+def generate_plan_route():
+    """Generate and store a plan from parameters: {"params", "plan_id"}.
+
+    Without plan_id the plan is stored under an id derived from the
+    parameters, so generating the same plan twice returns the same id.
+    """
+    data = request.get_json(silent=True) or {}
+    plan_id = data.get('plan_id')
+    if plan_id is not None and (not isinstance(plan_id, str) or not ATHLETE_ID_RE.match(plan_id)):
+        return jsonify({'success': False, 'error': 'plan_id must be 1-64 letters, digits, _ or -'}), 400
+    try:
+        info = generated_plan(data.get('params'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    plan_id = plan_id or info.plan_id
+    existing = get_plan_info(plan_id)
+    if existing is not None and existing.plan != info.plan:
+        return jsonify({'success': False, 'error': f'Plan {plan_id} already exists'}), 409
+    if existing is None:
+        plan_directory.put(plan_id, info.plan)
+        with _registry_lock:
+            _plan_infos.setdefault(plan_id, info if info.plan_id == plan_id else PlanInfo(plan_id, info.plan))
+    
+    return jsonify({
+        'success': True,
+        'plan_id': plan_id,
+        'race_date': info.plan['race_date'],
+        'start_date': info.start_date.isoformat(),
+        'weeks': info.num_weeks,
+        'total_planned_miles': info.total_planned_miles,
+        'goal': info.plan['goal'],
+        'paces': info.plan['paces']
+    })
+
+@app.route('/api/plans/<plan_id>')
+def get_plan_by_id(plan_id):
+    """Get any stored plan by id"""
+    info = get_plan_info(plan_id)
+    if info is None:
+        return jsonify({'error': f'Unknown plan: {plan_id}'}), 404
+    return cached_response(info.json, info.etag, 'application/json', max_age=PLAN_CACHE_MAX_AGE)
+
+@app.route('/api/reset_plan', methods=['POST'])
+def reset_plan():
+    """Reset all workout data (for QA/testing)"""
+    try:
+        deleted_count = current_store().clear()
+        return jsonify({
+            'success': True,
+            'message': f'Reset complete! Deleted {deleted_count} logged workouts.',
+            'deleted_count': deleted_count
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+# ============================================================================
+# TRAINING LOAD ANALYTICS
+# ============================================================================
+
+# Acute and chronic load are exponentially weighted averages of daily load
+# over these time constants; training stress balance is yesterday's chronic
+# minus acute load
+ANALYTICS_ATL_DAYS = int(os.getenv('ANALYTICS_ATL_DAYS', '7'))
+ANALYTICS_CTL_DAYS = int(os.getenv('ANALYTICS_CTL_DAYS', '42'))
+# Heart rates used to rate runs that have HR but no pace to compare with
+ANALYTICS_RESTING_HR = float(os.getenv('ANALYTICS_RESTING_HR', '60'))
+ANALYTICS_THRESHOLD_HR = float(os.getenv('ANALYTICS_THRESHOLD_HR', '170'))
+# A run within this many seconds/mile of its prescribed range counts as in zone
+ANALYTICS_PACE_TOLERANCE = float(os.getenv('ANALYTICS_PACE_TOLERANCE', '10'))
+# Intensity and pace assumed for a run logged with distance only
+ANALYTICS_DEFAULT_INTENSITY = 0.75
+ANALYTICS_DEFAULT_PACE = 600.0
+# Each foot climbed counts as this many feet on the flat (grade-adjusted pace)
+ANALYTICS_CLIMB_FACTOR = 8.0
+# Days solved per block by the closed-form moving average, so the growing
+# decay**-k factor stays well inside float range
+EWMA_BLOCK = 128
+
+PACE_RE = re.compile(r'(\d+):(\d{2})')
+PACE_RANGE = r'(\d+:\d{2})\s*-\s*(\d+:\d{2})'
+QUALITY_SEGMENT_RE = re.compile(
+    r'(?:(\d+)\s*x\s*)?(\d+(?:\.\d+)?)\s*(mi|km|k|m)\b\s*@\s*' + PACE_RANGE, re.IGNORECASE
+)
+EXPLICIT_RANGE_RE = re.compile(r'\(' + PACE_RANGE + r'\)')
+EASY_WORKOUT_RE = re.compile(r'\b(easy|long run|recovery|shakeout)\b', re.IGNORECASE)
+SEGMENT_UNIT_MILES = {'mi': 1.0, 'km': 1000 / METERS_PER_MILE, 'k': 1000 / METERS_PER_MILE, 'm': 1 / METERS_PER_MILE}
+
+
+def pace_seconds(text):
+    """Seconds per mile from a pace like "8:24", "8:24/mi" or "8:24 min/mi" (None if absent)"""
+    match = PACE_RE.search(text or '')
+    return int(match.group(1)) * 60 + int(match.group(2)) if match else None
+
+
+def duration_seconds(text):
+    """Seconds from "h:mm:ss", "mm:ss" or plain minutes (None if unparseable)"""
+    parts = str(text or '').strip().split(':')
+    try:
+        values = [float(p) for p in parts]
+    except ValueError:
+        return None
+    if len(values) == 1:
+        return values[0] * 60 or None
+    if len(values) > 3:
+        return None
+    seconds = 0.0
+    for value in values:
+        seconds = seconds * 60 + value
+    return seconds or None
+
+
+def _pace_range(low, high):
+    return sorted((pace_seconds(low), pace_seconds(high)))
+
+
+def _zone_range(paces, zone):
+    # Plans stored before paces were validated may hold anything here; a
+    # zone that isn't an "m:ss-m:ss" string leaves its workouts unrated
+    text = paces.get(zone)
+    if not isinstance(text, str) or not PLAN_PACE_RANGE_RE.match(text):
+        return None
+    return _pace_range(*text.split('-'))
+
+
+def _pace_text(seconds):
+    if seconds is None or np.isnan(seconds):
+        return None
+    seconds = int(round(float(seconds)))
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def _slot_target(slot, paces):
+    """(zone, low, high) prescribed average pace for a slot, or None for rest days and unrated runs.
+
+    Quality sessions blend their fast segment with easy running for the
+    rest of the distance, so the target is the whole-run average a runner
+    hitting both would produce.
+    """
+    if not slot.miles:
+        return None
+    easy = _zone_range(paces, 'easy')
+    race = _zone_range(paces, 'race')
+    if slot.day_type == 'RACE' and race:
+        return ('race', *race)
+
+    segments = QUALITY_SEGMENT_RE.findall(slot.workout)
+    if segments:
+        if easy is None:
+            return None
+        fast_miles, fast_low, fast_high = 0.0, 0.0, 0.0
+        for reps, distance, unit, low, high in segments:
+            miles = int(reps or 1) * float(distance) * SEGMENT_UNIT_MILES[unit.lower()]
+            seg_low, seg_high = _pace_range(low, high)
+            fast_miles += miles
+            fast_low += miles * seg_low
+            fast_high += miles * seg_high
+        easy_miles = max(slot.miles - fast_miles, 0.0)
+        total = fast_miles + easy_miles
+        if total <= 0:
+            return None
+        return ('quality', (fast_low + easy_miles * easy[0]) / total, (fast_high + easy_miles * easy[1]) / total)
+
+    explicit = EXPLICIT_RANGE_RE.search(slot.workout)
+    if explicit:
+        return ('easy', *_pace_range(*explicit.groups()))
+    if easy is not None and EASY_WORKOUT_RE.search(slot.workout):
+        return ('easy', *easy)
+    return None
+
+
+@functools.lru_cache(maxsize=PLAN_GENERATOR_CACHE_SIZE)
+def plan_pace_targets(plan_info):
+    """Per-slot prescribed pace arrays (low, high, seconds/mile; NaN where unrated), zone names and threshold pace"""
+    paces = plan_info.plan.get('paces')
+    paces = paces if isinstance(paces, dict) else {}
+    targets = [_slot_target(slot, paces) for slot in plan_info.slots]
+    low = np.array([t[1] if t else np.nan for t in targets], dtype=np.float64)
+    high = np.array([t[2] if t else np.nan for t in targets], dtype=np.float64)
+    zones = [t[0] if t else None for t in targets]
+    threshold = _zone_range(paces, 'threshold')
+    threshold = float(np.mean(threshold)) if threshold else None
+    return low, high, zones, threshold
+
+
+def exponential_load(daily, days):
+    """y[t] = y[t-1] + (daily[t] - y[t-1]) / days from y[-1] = 0, without a Python loop per day.
+
+    Unrolled, y[t] = decay**t * cumsum(daily[k] / days / decay**k), solved
+    block by block with the previous block's last value carried in.
+    """
+    decay = 1 - 1 / days
+    out = np.empty_like(daily)
+    level = 0.0
+    for start in range(0, len(daily), EWMA_BLOCK):
+        block = daily[start:start + EWMA_BLOCK]
+        powers = decay ** np.arange(len(block))
+        out[start:start + len(block)] = powers * (decay * level + np.cumsum(block / (days * powers)))
+        level = out[start + len(block) - 1]
+    return out
+
+
+def _float_or_nan(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return np.nan
+    return value if value > 0 else np.nan
+
+
+def _run_columns(plan_info, records):
+    """Completed runs in the plan window as parallel arrays (one entry per run)"""
+    keys, offsets, miles, durations, paces, climbs, heart_rates = [], [], [], [], [], [], []
+    for key, record in records.items():
+        slot = plan_info.slot_by_key.get(key)
+        if slot is None or not record.get('completed'):
+            continue
+        offset = (slot.date - plan_info.start_date).days
+        strava = record.get('strava_data') or {}
+        distance = _float_or_nan(record.get('actual_miles'))
+        if np.isnan(distance):
+            distance = _float_or_nan(strava.get('distance'))
+        if np.isnan(distance):
+            continue
+        duration = strava.get('moving_time') or duration_seconds(record.get('duration'))
+        keys.append(key)
+        offsets.append(offset)
+        miles.append(distance)
+        durations.append(_float_or_nan(duration))
+        paces.append(_float_or_nan(pace_seconds(record.get('actual_pace'))))
+        climbs.append(_float_or_nan(strava.get('total_elevation_gain')))
+        heart_rates.append(_float_or_nan(strava.get('average_heartrate')))
+    columns = (offsets, miles, durations, paces, climbs, heart_rates)
+    return keys, [np.array(c, dtype=np.int64 if i == 0 else np.float64) for i, c in enumerate(columns)]
+
+
+def training_load(plan_info, records):
+    """Daily load, ATL/CTL/TSB and pace adherence over the plan window.
+
+    Load is in TSS-like units (100 = one hour at threshold). Intensity comes
+    from grade-adjusted pace against the plan's threshold pace, else from
+    average heart rate between ANALYTICS_RESTING_HR and
+    ANALYTICS_THRESHOLD_HR, else ANALYTICS_DEFAULT_INTENSITY.
+    """
+    low, high, zones, threshold = plan_pace_targets(plan_info)
+    keys, (offsets, miles, durations, paces, climbs, heart_rates) = _run_columns(plan_info, records)
+    num_days = len(plan_info.slots)
+
+    # Fill whichever of pace and duration is missing from the other
+    durations = np.where(np.isnan(durations), paces * miles, durations)
+    paces = np.where(np.isnan(paces), durations / miles, paces)
+    effort_miles = miles + np.nan_to_num(climbs) * ANALYTICS_CLIMB_FACTOR / 5280
+    effort_paces = durations / effort_miles
+
+    pace_intensity = threshold / effort_paces if threshold else np.full(len(keys), np.nan)
+    hr_intensity = (heart_rates - ANALYTICS_RESTING_HR) / (ANALYTICS_THRESHOLD_HR - ANALYTICS_RESTING_HR)
+    by_pace, by_hr = ~np.isnan(pace_intensity), ~np.isnan(hr_intensity)
+    intensity = np.where(by_pace, pace_intensity, np.where(by_hr, hr_intensity, ANALYTICS_DEFAULT_INTENSITY))
+    hours = np.where(np.isnan(durations), miles * ANALYTICS_DEFAULT_PACE, durations) / 3600
+    loads = hours * np.clip(intensity, 0, None) ** 2 * 100
+
+    daily = np.bincount(offsets, weights=loads, minlength=num_days).astype(np.float64)
+    atl = exponential_load(daily, ANALYTICS_ATL_DAYS)
+    ctl = exponential_load(daily, ANALYTICS_CTL_DAYS)
+    tsb = np.concatenate(([0.0], ctl[:-1] - atl[:-1]))
+
+    # Pace adherence against each run's prescribed range
+    run_low, run_high = low[offsets], high[offsets]
+    rated = ~np.isnan(run_low) & ~np.isnan(effort_paces)
+    deviation = np.where(effort_paces < run_low, effort_paces - run_low,
+                         np.where(effort_paces > run_high, effort_paces - run_high, 0.0))
+    in_zone = rated & (np.abs(deviation) <= ANALYTICS_PACE_TOLERANCE)
+    faster = rated & ~in_zone & (deviation < 0)
+    slower = rated & ~in_zone & (deviation > 0)
+    week_idx = np.array([plan_info.slots[o].week_idx for o in offsets.tolist()], dtype=np.int64)
+    weekly_rated = np.bincount(week_idx[rated], minlength=plan_info.num_weeks)
+    weekly_in_zone = np.bincount(week_idx[in_zone], minlength=plan_info.num_weeks)
+
+    run_zones = np.array([zones[o] or '' for o in offsets.tolist()], dtype=object)
+    by_zone = {}
+    for zone in sorted(set(run_zones[rated].tolist())):
+        mask = rated & (run_zones == zone)
+        by_zone[zone] = {'rated': int(mask.sum()), 'in_zone': int((mask & in_zone).sum())}
+
+    workouts = {}
+    for i, key in enumerate(keys):
+        offset = int(offsets[i])
+        workouts[key] = {
+            'date': plan_info.slots[offset].date.isoformat(),
+            'load': round(float(loads[i]), 1),
+            'intensity': round(float(intensity[i]), 2),
+            'load_source': 'pace' if by_pace[i] else 'heart_rate' if by_hr[i] else 'distance',
+            'zone': zones[offset],
+            'target': f"{_pace_text(low[offset])}-{_pace_text(high[offset])}" if rated[i] else None,
+            'effort_pace': _pace_text(effort_paces[i]),
+            'adherence': ('in_zone' if in_zone[i] else 'faster' if faster[i] else 'slower') if rated[i] else None,
+            'deviation_seconds': round(float(deviation[i])) if rated[i] else None
+        }
+
+    return {
+        'start': plan_info.start_date.isoformat(),
+        'end': plan_info.end_date.isoformat(),
+        'daily_load': np.round(daily, 1).tolist(),
+        'atl': np.round(atl, 1).tolist(),
+        'ctl': np.round(ctl, 1).tolist(),
+        'tsb': np.round(tsb, 1).tolist(),
+        'adherence': {
+            'rated': int(rated.sum()),
+            'in_zone': int(in_zone.sum()),
+            'faster': int(faster.sum()),
+            'slower': int(slower.sum()),
+            'in_zone_pct': round(100 * float(in_zone.sum()) / int(rated.sum()), 1) if rated.any() else None,
+            'by_zone': by_zone,
+            'weekly_in_zone_pct': [
+                round(100 * int(z) / int(r), 1) if r else None for z, r in zip(weekly_in_zone, weekly_rated)
+            ]
+        },
+        'workouts': workouts,
+        'model': {
+            'atl_days': ANALYTICS_ATL_DAYS,
+            'ctl_days': ANALYTICS_CTL_DAYS,
+            'threshold_pace': _pace_text(threshold) if threshold else None,
+            'pace_tolerance_seconds': ANALYTICS_PACE_TOLERANCE
+        }
+    }
+
+
+@app.route('/api/analytics')
+def analytics():
+    """Training load (daily load, ATL, CTL, TSB) and pace adherence over the athlete's plan window.
+
+    Computed from the workout records once per change and cached until the
+    next mutation; "current" is read off the cached series for today.
+    """
+    athlete_id = current_athlete_id()
+    plan = athlete_plan(athlete_id)
+    result = get_workout_store(athlete_id).derived('training_load', lambda records: training_load(plan, records))
+    day = min(max(date.today(), plan.start_date), plan.end_date)
+    offset = (day - plan.start_date).days
+    current = {
+        'date': day.isoformat(),
+        'atl': result['atl'][offset],
+        'ctl': result['ctl'][offset],
+        'tsb': result['tsb'][offset]
+    }
+    return jsonify({**result, 'current': current})
+
+# ============================================================================
+# EXPORT / IMPORT
+# ============================================================================
+
+# Records per chunk of export output and per backend write on import (the
+# Firestore batch limit, so an imported batch is one commit)
+EXPORT_CHUNK_SIZE = 500
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '500'))
+IMPORT_MAX_ERRORS = 20
+WORKOUT_KEY_FULL_RE = re.compile(r'^w\d+_d\d+$')
+# Record fields with their own CSV column; anything else (edit history,
+# Strava data, non-string values) travels as JSON in the "extra" column
+CSV_FIELDS = ('completed', 'actual_miles', 'actual_pace', 'duration', 'notes', 'date_logged')
+CSV_COLUMNS = ('key', 'date') + CSV_FIELDS + ('extra',)
+
+
+def _csv_row(key, record, plan):
+    slot = plan.slot_by_key.get(key)
+    row = {'key': key, 'date': slot.date.isoformat() if slot else ''}
+    extra = {}
+    for field, value in record.items():
+        if field == 'completed' and isinstance(value, bool):
+            row[field] = 'true' if value else 'false'
+        elif field in CSV_FIELDS and isinstance(value, str) and value:
+            row[field] = value
+        else:
+            extra[field] = value
+    row['extra'] = json.dumps(extra, separators=(',', ':')) if extra else ''
+    return row
+
+
+def _record_from_csv(row):
+    record = json.loads(row['extra']) if row.get('extra') else {}
+    if not isinstance(record, dict):
+        raise ValueError('extra must be a JSON object')
+    for field in CSV_FIELDS:
+        value = row.get(field)
+        if value:
+            record[field] = value.lower() == 'true' if field == 'completed' else value
+    return record
+
+
+def export_rows(athlete_id, fmt):
+    """Yield the athlete's workouts as NDJSON or CSV text, EXPORT_CHUNK_SIZE records per chunk"""
+    plan = athlete_plan(athlete_id)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, CSV_COLUMNS) if fmt == 'csv' else None
+    if writer:
+        writer.writeheader()
+    count = 0
+    for key, record in storage.iter_records(athlete_id, 'workouts'):
+        if writer:
+            writer.writerow(_csv_row(key, record, plan))
+        else:
+            buffer.write(json.dumps({'key': key, 'data': record}, separators=(',', ':')) + '\n')
+        count += 1
+        if count % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+    count_storage_records('workouts', 'export', count)
+
+
+def import_rows(lines, fmt):
+    """Yield (line number, key, record, error) per NDJSON or CSV row; rows that don't parse carry an error"""
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            try:
+                record, error = _record_from_csv(row), None
+            except ValueError as e:
+                record, error = None, str(e)
+            yield reader.line_num, row.get('key'), record, error
+        return
+    for line_num, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            entry, error = json.loads(line), None
+        except ValueError as e:
+            entry, error = {}, str(e)
+        if not isinstance(entry, dict):
+            entry, error = {}, 'expected a {"key", "data"} object'
+        yield line_num, entry.get('key'), entry.get('data'), error
+
+
+def _export_format():
+    fmt = request.args.get('format')
+    if fmt is None:
+        fmt = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+    if fmt not in ('ndjson', 'csv'):
+        raise ValueError('format must be ndjson or csv')
+    return fmt
+
+
+@app.route('/api/export')
+def export_workouts():
+    """Stream every workout record as NDJSON ({"key", "data"} per line) or CSV (?format=csv)"""
+    athlete_id = current_athlete_id()
+    try:
+        fmt = _export_format()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    filename = f"workouts-{athlete_id}-{date.today().isoformat()}.{fmt}"
+    response = app.response_class(
+        export_rows(athlete_id, fmt),
+        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.cache_control.no_store = True
+    return response
+
+
+@app.route('/api/import', methods=['POST'])
+def import_workouts():
+    """Apply an NDJSON or CSV export (format from ?format= or Content-Type) in IMPORT_BATCH_SIZE batches.
+
+    Rows are read from the request body as it arrives, so memory use does
+    not grow with the upload. Existing records with the same key are
+    replaced. With ?replace=1, records the upload doesn't contain are
+    deleted afterwards, and only if every row was read and saved, so a bad
+    upload never erases existing history. Bad rows are skipped and reported.
+    """
+    store = current_store()
+    try:
+        fmt = _export_format()
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    replace = request.args.get('replace') == '1'
+    
+    lines = (line.decode('utf-8', errors='replace') for line in request.stream)
+    imported, skipped, errors, batch, keys = 0, 0, [], {}, set()
+    for line_num, key, record, error in import_rows(lines, fmt):
+        if error is None and (not isinstance(key, str) or not WORKOUT_KEY_FULL_RE.match(key)):
+            error = f'invalid workout key {key!r}'
+        if error is None and not isinstance(record, dict):
+            error = 'record must be an object'
+        if error is not None:
+            skipped += 1
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({'line': line_num, 'error': error})
+            continue
+        batch[key] = record
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            if not store.put_many(batch):
+                return jsonify({'success': False, 'error': 'Failed to save workouts', 'imported': imported}), 500
+            imported += len(batch)
+            keys.update(batch)
+            batch = {}
+    if batch:
+        if not store.put_many(batch):
+            return jsonify({'success': False, 'error': 'Failed to save workouts', 'imported': imported}), 500
+        imported += len(batch)
+        keys.update(batch)
+    count_storage_records('workouts', 'import', imported)
+    
+    removed = 0
+    if replace:
+        if not imported or skipped:
+            return jsonify({
+                'success': False, 'error': 'Upload had no valid rows or some rows could not be read; no workouts were removed',
+                'imported': imported, 'skipped': skipped, 'errors': errors
+            }), 400
+        stale = [key for key in store.all() if key not in keys]
+        for start in range(0, len(stale), IMPORT_BATCH_SIZE):
+            if not store.apply([(key, None) for key in stale[start:start + IMPORT_BATCH_SIZE]]):
+                return jsonify({'success': False, 'error': 'Failed to remove workouts', 'imported': imported}), 500
+            removed += len(stale[start:start + IMPORT_BATCH_SIZE])
+    return jsonify({'success': True, 'imported': imported, 'skipped': skipped, 'removed': removed, 'errors': errors})
+
+# ============================================================================
+# STRAVA INTEGRATION ENDPOINTS
+# ============================================================================
+
+STRAVA_CONNECT_TIMEOUT = float(os.getenv('STRAVA_CONNECT_TIMEOUT', '5'))
+STRAVA_READ_TIMEOUT = float(os.getenv('STRAVA_READ_TIMEOUT', '20'))
+STRAVA_MAX_RETRIES = int(os.getenv('STRAVA_MAX_RETRIES', '3'))
+STRAVA_MAX_RETRY_WAIT = float(os.getenv('STRAVA_MAX_RETRY_WAIT', '30'))
+STRAVA_RETRY_STATUSES = {429, 500, 502, 503, 504}
+STRAVA_IDEMPOTENT_METHODS = {'GET', 'HEAD'}
+# Numeric path segments (activity ids) are collapsed in metric labels
+STRAVA_ENDPOINT_ID_RE = re.compile(r'/\d+')
+
+
+class StravaRateLimitError(Exception):
+    """Strava's rate limit is exhausted; retry_after is the wait in seconds, if known"""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def rate_limited_response(e, body):
+    """429 for a StravaRateLimitError, with Retry-After when the wait is known"""
+    response = jsonify(body)
+    response.status_code = 429
+    if e.retry_after is not None:
+        response.headers['Retry-After'] = str(int(math.ceil(e.retry_after)))
+    return response
+
+
+class StravaClient:
+    """Shared HTTP client for every Strava call.
+
+    One keep-alive session is pooled across the gunicorn threads, every
+    request gets a bounded (connect, read) timeout, and 429/5xx responses are
+    retried with exponential backoff that honours Retry-After. Usage headers
+    from each response are recorded so calls can be refused locally once the
+    15-minute window is spent instead of burning more requests.
+    """
+
+    def __init__(self, timeout=(STRAVA_CONNECT_TIMEOUT, STRAVA_READ_TIMEOUT),
+                 max_retries=STRAVA_MAX_RETRIES, max_retry_wait=STRAVA_MAX_RETRY_WAIT):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_retry_wait = max_retry_wait
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=8)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._lock = threading.Lock()
+        self.rate_limit = {}
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        # POSTs (token exchanges) are only retried when Strava refused them
+        # outright, since a 5xx may have already consumed the code/token
+        return self.request('POST', url, retry_statuses={429}, **kwargs)
+
+    def request(self, method, url, retry_statuses=STRAVA_RETRY_STATUSES, **kwargs):
+        """Send a request with pooling, timeouts and Retry-After-aware backoff"""
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = STRAVA_ENDPOINT_ID_RE.sub('/:id', urlparse(url).path)
+        attempt = 0
+        while True:
+            self._check_rate_limit()
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.ConnectionError:
+                metrics.observe('strava_request_duration_seconds', time.perf_counter() - started,
+                                method=method, endpoint=endpoint, status='connection_error')
+                # A dropped POST may already have spent its code or refresh
+                # token, so only idempotent requests are resent
+                if method not in STRAVA_IDEMPOTENT_METHODS or attempt >= self.max_retries:
+                    raise
+                wait = self._backoff(attempt)
+                metrics.inc('strava_retries_total', reason='connection_error')
+            else:
+                metrics.observe('strava_request_duration_seconds', time.perf_counter() - started,
+                                method=method, endpoint=endpoint, status=str(response.status_code))
+                self._record_usage(response)
+                if response.status_code not in retry_statuses or attempt >= self.max_retries:
+                    return response
+                wait = self._retry_after(response, attempt)
+                metrics.inc('strava_retries_total', reason=str(response.status_code))
+            if wait > self.max_retry_wait:
+                raise StravaRateLimitError(f"Strava asked us to wait {wait:.0f}s before retrying", wait)
+            time.sleep(wait)
+            attempt += 1
+
+    @staticmethod
+    def _backoff(attempt):
+        return min(2 ** attempt * 0.5, 8) * (0.5 + random.random() / 2)
+
+    def _retry_after(self, response, attempt):
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        if response.status_code == 429:
+            return self._seconds_until_window_reset()
+        return self._backoff(attempt)
+
+    @staticmethod
+    def _seconds_until_window_reset(now=None):
+        # Strava's short-term window resets on the quarter hour
+        now = now or time.time()
+        return 900 - (now % 900)
+
+    def _record_usage(self, response):
+        limits = response.headers.get('X-RateLimit-Limit')
+        usage = response.headers.get('X-RateLimit-Usage')
+        if not limits or not usage:
+            return
+        try:
+            short_limit, daily_limit = (int(v) for v in limits.split(','))
+            short_usage, daily_usage = (int(v) for v in usage.split(','))
+        except ValueError:
+            return
+        with self._lock:
+            self.rate_limit = {
+                'short_limit': short_limit,
+                'short_usage': short_usage,
+                'daily_limit': daily_limit,
+                'daily_usage': daily_usage,
+                'window': int(time.time() // 900),
+                'day': time.strftime('%Y-%m-%d', time.gmtime())
+            }
+
+    def _check_rate_limit(self):
+        with self._lock:
+            status = dict(self.rate_limit)
+        if not status:
+            return
+        if (status['day'] == time.strftime('%Y-%m-%d', time.gmtime())
+                and status['daily_usage'] >= status['daily_limit']):
+            metrics.inc('strava_rate_limit_refusals_total', window='daily')
+            raise StravaRateLimitError("Strava daily rate limit exhausted", 86400 - time.time() % 86400)
+        if (status['window'] == int(time.time() // 900)
+                and status['short_usage'] >= status['short_limit']):
+            # Refused rather than slept on, so a spent window never holds a
+            # request thread; callers answer 429 and the client backs off
+            wait = self._seconds_until_window_reset()
+            metrics.inc('strava_rate_limit_refusals_total', window='15min')
+            raise StravaRateLimitError(f"Strava 15-minute rate limit exhausted, resets in {wait:.0f}s", wait)
+
+    def rate_limit_status(self):
+        """Latest usage reported by Strava, with remaining headroom"""
+        with self._lock:
+            status = dict(self.rate_limit)
+        if status:
+            status['short_remaining'] = max(status['short_limit'] - status['short_usage'], 0)
+            status['daily_remaining'] = max(status['daily_limit'] - status['daily_usage'], 0)
+        return status
+
+
+strava_client = LazyComponent('strava_client', StravaClient)
+
+
+def _strava_rate_limit_samples():
+    if not strava_client._ready:
+        return []
+    status = strava_client.rate_limit_status()
+    if not status:
+        return []
+    return [
+        ({'window': '15min'}, status['short_remaining']),
+        ({'window': 'daily'}, status['daily_remaining'])
+    ]
+
+
+metrics.gauge('strava_rate_limit_remaining', 'Strava requests left in each rate-limit window, as last reported',
+              _strava_rate_limit_samples)
+
+STRAVA_TOKEN_EXPIRY_MARGIN = 60
+STRAVA_MISSING_TOKEN_TTL = 60
+# Where the json backend keeps OAuth tokens (Firestore and SQLite store them alongside the rest)
+STRAVA_TOKEN_FILE = os.getenv('STRAVA_TOKEN_FILE', '/tmp/strava_tokens.json')
+STRAVA_OWNERS_FILE = os.getenv('STRAVA_OWNERS_FILE', '/tmp/strava_owners.json')
+# Tokens this close to expiry are refreshed by a background job when noticed
+STRAVA_TOKEN_REFRESH_AHEAD = int(os.getenv('STRAVA_TOKEN_REFRESH_AHEAD', '600'))
+
+
+class StravaTokenCache:
+    """In-memory copy of the stored Strava token with single-flight refresh.
+
+    The access token is served from memory until STRAVA_TOKEN_EXPIRY_MARGIN
+    seconds before expires_at. When it needs refreshing, the first thread
+    performs the refresh and every other thread waits for its result, so
+    concurrent requests never spend the same refresh token twice.
+    """
+
+    def __init__(self, athlete_id):
+        self.athlete_id = athlete_id
+        self._cond = threading.Condition()
+        self._token = None
+        self._loaded_at = None
+        self._refreshing = False
+
+    def _read_stored(self):
+        with storage_timer('strava_tokens', 'load'):
+            return storage.get(self.athlete_id, 'strava_tokens', 'user_token')
+
+    def _write_stored(self, token):
+        with storage_timer('strava_tokens', 'write'):
+            storage.apply(self.athlete_id, [('strava_tokens', 'user_token', token)])
+
+    def _is_fresh(self, token, margin=STRAVA_TOKEN_EXPIRY_MARGIN):
+        return time.time() < token.get('expires_at', 0) - margin
+
+    def info(self):
+        """Stored token document (loaded at most once per STRAVA_MISSING_TOKEN_TTL when absent)"""
+        with self._cond:
+            if self._token is None and (
+                    self._loaded_at is None or time.time() - self._loaded_at >= STRAVA_MISSING_TOKEN_TTL):
+                self._token = self._read_stored()
+                self._loaded_at = time.time()
+            return dict(self._token) if self._token else None
+
+    def access_token(self, margin=STRAVA_TOKEN_EXPIRY_MARGIN):
+        """Valid access token, refreshing it (once across threads) if it expires within `margin` seconds"""
+        token = self.info()
+        if token is None:
+            return None
+        if self._is_fresh(token, margin):
+            return token['access_token']
+
+        with self._cond:
+            if self._refreshing:
+                self._cond.wait_for(lambda: not self._refreshing)
+                return self._token['access_token'] if self._token and self._is_fresh(self._token) else None
+            self._refreshing = True
+
+        refreshed = None
+        try:
+            refreshed = self._refresh(margin)
+        finally:
+            with self._cond:
+                if refreshed is not None:
+                    self._token = refreshed
+                self._refreshing = False
+                self._cond.notify_all()
+        return refreshed['access_token']
+
+    def _refresh(self, margin):
+        # Another instance may already have refreshed the stored token
+        stored = self._read_stored()
+        if stored and self._is_fresh(stored, margin):
+            return stored
+        token_data = stored or self._token
+
+        logger.info('Refreshing Strava token', extra={'athlete_id': self.athlete_id})
+        refresh_data = {
+            'client_id': STRAVA_CLIENT_ID,
+            'client_secret': STRAVA_CLIENT_SECRET,
+            'grant_type': 'refresh_token',
+            'refresh_token': token_data['refresh_token']
+        }
+        response = strava_client.post(STRAVA_TOKEN_URL, data=refresh_data)
+        response.raise_for_status()
+        new_tokens = response.json()
+
+        update = {
+            'access_token': new_tokens['access_token'],
+            'refresh_token': new_tokens['refresh_token'],
+            'expires_at': new_tokens['expires_at'],
+            'updated_at': datetime.now().isoformat()
+        }
+        refreshed = {**token_data, **update}
+        self._write_stored(refreshed)
+        logger.info('Strava token refreshed', extra={'athlete_id': self.athlete_id})
+        return refreshed
+
+    def set(self, token):
+        """Store and cache the token from a new authorization"""
+        previous = self.info()
+        with self._cond:
+            self._write_stored(token)
+            self._token = dict(token)
+            self._loaded_at = time.time()
+        if previous and previous.get('athlete_id') != token.get('athlete_id'):
+            unlink_strava_owner(previous.get('athlete_id'), self.athlete_id)
+        link_strava_owner(token.get('athlete_id'), self.athlete_id)
+
+    def clear(self):
+        """Forget the stored token after the athlete revokes access on Strava"""
+        previous = self.info()
+        with self._cond:
+            self._write_stored(None)
+            self._token = None
+            self._loaded_at = time.time()
+        if previous:
+            unlink_strava_owner(previous.get('athlete_id'), self.athlete_id)
+
+    def clear_if_revoked(self):
+        """Clear the token only if Strava rejects it (401 on refresh or on an API call); True when cleared"""
+        try:
+            access_token = self.access_token()
+            if access_token is None:
+                return False
+            response = strava_client.get(f'{STRAVA_API_BASE}/athlete',
+                                         headers={'Authorization': f'Bearer {access_token}'})
+        except requests.HTTPError as e:
+            response = e.response
+        if response is None or response.status_code != 401:
+            return False
+        self.clear()
+        return True
+
+
+_strava_token_caches = {}
+
+
+def get_strava_token_cache(athlete_id):
+    """The StravaTokenCache for one athlete's stored token"""
+    return _per_athlete(_strava_token_caches, athlete_id, StravaTokenCache)
+
+
+def get_valid_strava_token(athlete_id):
+    """Get valid Strava access token, refresh if needed.
+
+    None means not connected (or the refresh failed); a rate-limited refresh
+    raises StravaRateLimitError so callers can answer 429 rather than 401.
+    """
+    try:
+        return get_strava_token_cache(athlete_id).access_token()
+    except StravaRateLimitError:
+        raise
+    except Exception as e:
+        logger.error('Error getting Strava token', extra={'athlete_id': athlete_id, 'error': str(e)})
+        return None
+
+# The OAuth state is a random nonce, echoed back in a short-lived cookie set
+# on the browser that started the flow together with the athlete it is for.
+# The callback only trusts a state matching that cookie, so nobody can
+# finish a flow that attaches their Strava account to someone else's athlete.
+# Nothing is kept server-side, so the callback may land on any instance.
+STRAVA_STATE_COOKIE = 'strava_oauth_state'
+STRAVA_STATE_MAX_AGE = 600
+
+
+def _strava_state_athlete(state):
+    """Athlete the OAuth flow was started for, if `state` matches this browser's cookie"""
+    nonce, _, athlete_id = request.cookies.get(STRAVA_STATE_COOKIE, '').partition(':')
+    if not state or not nonce or not hmac.compare_digest(state, nonce):
+        return None
+    return athlete_id
+
+
+@app.route('/api/strava/authorize')
+def strava_authorize():
+    """Redirect user to Strava authorization page"""
+    if not STRAVA_CLIENT_ID:
+        return jsonify({'error': 'Strava not configured. Please set STRAVA_CLIENT_ID in environment.'}), 500
+    
+    params = {
+        'client_id': STRAVA_CLIENT_ID,
+        'redirect_uri': STRAVA_REDIRECT_URI,
+        'response_type': 'code',
+        'scope': 'activity:read_all',
+        'approval_prompt': 'auto',
+        'state': secrets.token_urlsafe(24)
+    }
+    auth_url = f"{STRAVA_AUTH_URL}?{urlencode(params)}"
+    response = jsonify({'auth_url': auth_url})
+    response.set_cookie(
+        STRAVA_STATE_COOKIE, f"{params['state']}:{current_athlete_id()}", max_age=STRAVA_STATE_MAX_AGE,
+        path='/api/strava/callback', httponly=True, secure=request.is_secure, samesite='Lax'
+    )
+    return response
+
+@app.route('/api/strava/callback')
+def strava_callback():
+    """Handle OAuth callback from Strava"""
+    code = request.args.get('code')
+    athlete_id = _strava_state_athlete(request.args.get('state'))
+    
+    if not code:
+        return '<html><body><h2>❌ Authorization failed</h2><p>No authorization code received.</p><button onclick="window.close()">Close</button></body></html>'
+    if athlete_id is None:
+        return '<html><body><h2>❌ Authorization failed</h2><p>This sign-in was not started from this browser, or it expired. Please connect again.</p><button onclick="window.close()">Close</button></body></html>'
+    if not ATHLETE_ID_RE.match(athlete_id) or get_athlete(athlete_id) is None:
+        return '<html><body><h2>❌ Authorization failed</h2><p>Unknown athlete.</p><button onclick="window.close()">Close</button></body></html>'
+    
+    try:
+        # Exchange code for access token
+        token_data = {
+            'client_id': STRAVA_CLIENT_ID,
+            'client_secret': STRAVA_CLIENT_SECRET,
+            'code': code,
+            'grant_type': 'authorization_code'
+        }
+        
+        response = strava_client.post(STRAVA_TOKEN_URL, data=token_data)
+        response.raise_for_status()
+        tokens = response.json()
+        
+        # Store tokens in the storage backend and the in-process token cache
+        token_doc = {
+            'access_token': tokens['access_token'],
+            'refresh_token': tokens['refresh_token'],
+            'expires_at': tokens['expires_at'],
+            'athlete_id': tokens['athlete']['id'],
+            'athlete_name': f"{tokens['athlete']['firstname']} {tokens['athlete']['lastname']}",
+            'updated_at': datetime.now().isoformat()
+        }
+        get_strava_token_cache(athlete_id).set(token_doc)
+        
+        # A (re)connected account may be a different Strava athlete; refill
+        # the cache for the plan window in the background
+        get_strava_activity_cache(athlete_id).invalidate()
+        job_queue.submit('strava_cache_warm', athlete_id, _strava_cache_warm_job, athlete_id,
+                         dedupe_key=('strava_cache_warm', athlete_id))
+        
+        # Success page that closes popup; the state cookie is single-use
+        response = app.response_class('''
         <html>
         <head><title>Strava Authorization</title></head>
         <body style="font-family: Arial; text-align: center; padding: 50px;">
@@ -651,111 +3186,816 @@ def strava_callback():
             </script>
         </body>
         </html>
-        '''
+        ''', mimetype='text/html')
+        response.delete_cookie(STRAVA_STATE_COOKIE, path='/api/strava/callback')
+        return response
     
     except Exception as e:
-        print(f"Error exchanging code for token: {e}")
+        logger.error('Error exchanging code for token', extra={'athlete_id': athlete_id, 'error': str(e)})
         return f'<html><body><h2>❌ Authorization Error</h2><p>{str(e)}</p><button onclick="window.close()">Close</button></body></html>'
 
 @app.route('/api/strava/check_auth')
 def strava_check_auth():
     """Check if user has authorized Strava"""
+    athlete_id = current_athlete_id()
     try:
-        if not USE_FIRESTORE:
-            return jsonify({'authorized': False, 'message': 'Firestore not available'})
-        
-        token_doc = db.collection('strava_tokens').document('user_token').get()
-        if token_doc.exists:
-            token_data = token_doc.to_dict()
+        token_data = get_strava_token_cache(athlete_id).info()
+        if token_data:
+            # Refresh a soon-to-expire token now rather than on the next Strava call
+            if time.time() >= token_data.get('expires_at', 0) - STRAVA_TOKEN_REFRESH_AHEAD:
+                job_queue.submit('strava_token_refresh', athlete_id, _strava_token_refresh_job, athlete_id,
+                                 dedupe_key=('strava_token_refresh', athlete_id))
             return jsonify({
                 'authorized': True,
                 'athlete_name': token_data.get('athlete_name', 'Unknown')
             })
         return jsonify({'authorized': False})
     except Exception as e:
-        print(f"Error checking Strava auth: {e}")
+        logger.error('Error checking Strava auth', extra={'athlete_id': athlete_id, 'error': str(e)})
         return jsonify({'authorized': False, 'error': str(e)})
 
+# ============================================================================
+# STRAVA ACTIVITY CACHE
+# ============================================================================
+
+# Activities by id. The pre-backend cache kept activity:<id> and day:<date>
+# entries together in /tmp/strava_activities.json (STRAVA_CACHE_FILE); that
+# file is left alone rather than misread, and the cache refills from Strava.
+STRAVA_ACTIVITIES_FILE = os.getenv('STRAVA_ACTIVITIES_FILE', '/tmp/strava_activities_by_id.json')
+STRAVA_CACHE_DAYS_FILE = os.getenv('STRAVA_CACHE_DAYS_FILE', '/tmp/strava_activity_days.json')
+STRAVA_CACHE_TTL = int(os.getenv('STRAVA_CACHE_TTL', str(6 * 3600)))
+# A day can still gain runs until it has ended in every timezone and watches
+# have synced, so a fetch made before then only counts for
+# STRAVA_CACHE_RECENT_TTL (default 0: always fetched again)
+STRAVA_CACHE_RECENT_TTL = int(os.getenv('STRAVA_CACHE_RECENT_TTL', '0'))
+STRAVA_DAY_SETTLE_SECONDS = 2 * 86400
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+STRAVA_PAGE_SIZE = 200
+
+# Fields of a Strava summary activity that the app actually uses
+STRAVA_ACTIVITY_FIELDS = (
+    'id', 'name', 'type', 'distance', 'moving_time', 'elapsed_time',
+    'total_elevation_gain', 'start_date', 'start_date_local',
+    'average_heartrate', 'max_heartrate'
+)
+
+
+def activity_local_date(activity):
+    """Server-local calendar date an activity started on (matches the after/before window)"""
+    started = datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00'))
+    return started.astimezone().date()
+
+
+def day_bounds(start_day, end_day):
+    """Unix timestamps for the start of start_day and the end of end_day"""
+    start = datetime.combine(start_day, datetime.min.time())
+    end = datetime.combine(end_day, datetime.min.time()).replace(hour=23, minute=59, second=59)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+class StravaActivityCache:
+    """Fetched Strava activities indexed by start date, with a per-day TTL.
+
+    Each calendar day records when it was last fetched and which activity ids
+    started on it. A lookup over a date range is answered from memory, and
+    only the runs of consecutive days that are missing or older than the TTL
+    are fetched from Strava. Days fetched before they were over (today,
+    yesterday) use the short recent TTL instead. Activities and days persist to the storage
+    backend as two collections.
+    """
+
+    def __init__(self, athlete_id, ttl):
+        self.athlete_id = athlete_id
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._activities = None
+        self._days = None
+
+    def _ensure_loaded(self):
+        if self._activities is not None:
+            return
+        with storage_timer('strava_activities', 'load'):
+            activities = storage.load(self.athlete_id, 'strava_activities')
+            days = storage.load(self.athlete_id, 'strava_activity_days')
+        count_storage_records('strava_activities', 'load', len(activities) + len(days))
+        self._activities, self._days = activities, days
+
+    def stale_ranges(self, start_day, end_day, now=None):
+        """Runs of consecutive days in [start_day, end_day] that need fetching"""
+        now = now or time.time()
+        ranges = []
+        with self._lock:
+            self._ensure_loaded()
+            day = start_day
+            while day <= end_day:
+                entry = self._days.get(day.isoformat())
+                settled_at = (day.toordinal() - EPOCH_ORDINAL) * 86400 + STRAVA_DAY_SETTLE_SECONDS
+                if entry is not None:
+                    ttl = self.ttl if entry['fetched_at'] >= settled_at else STRAVA_CACHE_RECENT_TTL
+                if entry is None or now - entry['fetched_at'] >= ttl:
+                    if ranges and ranges[-1][1] == day - timedelta(days=1):
+                        ranges[-1][1] = day
+                    else:
+                        ranges.append([day, day])
+                day += timedelta(days=1)
+        return [tuple(r) for r in ranges]
+
+    def store_range(self, start_day, end_day, activities, now=None):
+        """Record a fresh fetch covering every day in [start_day, end_day]"""
+        now = now or time.time()
+        trimmed = {
+            str(a['id']): {f: a.get(f) for f in STRAVA_ACTIVITY_FIELDS}
+            for a in activities
+        }
+        by_day = {}
+        for activity_id, activity in trimmed.items():
+            by_day.setdefault(activity_local_date(activity).isoformat(), []).append(activity_id)
+
+        days = {}
+        day = start_day
+        while day <= end_day:
+            days[day.isoformat()] = {'fetched_at': now, 'ids': sorted(by_day.get(day.isoformat(), []))}
+            day += timedelta(days=1)
+
+        with self._lock:
+            self._ensure_loaded()
+            self._persist(trimmed, days)
+            self._activities.update(trimmed)
+            self._days.update(days)
+
+    def store_activity(self, activity):
+        """Add or update one activity (e.g. pushed by the webhook) without refetching its day.
+
+        Days keep their fetch time, so a day that was never fetched in full
+        stays stale and is still fetched on the next lookup.
+        """
+        activity_id = str(activity['id'])
+        trimmed = {f: activity.get(f) for f in STRAVA_ACTIVITY_FIELDS}
+        day = activity_local_date(trimmed).isoformat()
+        with self._lock:
+            self._ensure_loaded()
+            days = self._without_activity(activity_id, keep_day=day)
+            entry = self._days.get(day, {'fetched_at': 0, 'ids': []})
+            if activity_id not in entry['ids']:
+                days[day] = {**entry, 'ids': sorted(entry['ids'] + [activity_id])}
+            self._persist({activity_id: trimmed}, days)
+            self._activities[activity_id] = trimmed
+            self._days.update(days)
+
+    def remove_activity(self, activity_id):
+        """Drop a deleted activity; returns whether it was cached"""
+        activity_id = str(activity_id)
+        with self._lock:
+            self._ensure_loaded()
+            if activity_id not in self._activities:
+                return False
+            days = self._without_activity(activity_id)
+            self._persist({}, days, deleted=[activity_id])
+            del self._activities[activity_id]
+            self._days.update(days)
+            return True
+
+    def _without_activity(self, activity_id, keep_day=None):
+        # Day entries to rewrite so they no longer list the activity (it may
+        # have moved to another day when its start time was edited)
+        cached = self._activities.get(activity_id)
+        if cached is None:
+            return {}
+        day = activity_local_date(cached).isoformat()
+        entry = self._days.get(day)
+        if day == keep_day or entry is None or activity_id not in entry['ids']:
+            return {}
+        return {day: {**entry, 'ids': [i for i in entry['ids'] if i != activity_id]}}
+
+    def _persist(self, activities, days, deleted=()):
+        count_storage_records('strava_activities', 'write', len(activities) + len(days) + len(deleted))
+        with storage_timer('strava_activities', 'write'):
+            self._write(activities, days, deleted)
+
+    def _write(self, activities, days, deleted):
+        writes = [('strava_activities', k, v) for k, v in activities.items()]
+        writes += [('strava_activity_days', k, v) for k, v in days.items()]
+        writes += [('strava_activities', k, None) for k in deleted]
+        if writes:
+            storage.apply(self.athlete_id, writes)
+        if any(storage.needs_compaction(self.athlete_id, c) for c in ('strava_activities', 'strava_activity_days')):
+            job_queue.submit('compact_journal', self.athlete_id, self.compact_journal,
+                             dedupe_key=('compact_journal', 'strava_activities', self.athlete_id))
+
+    def compact_journal(self):
+        """Fold the local journals into fresh snapshots; run as a background job"""
+        with self._lock:
+            if self._activities is None:
+                return False
+            compacted = False
+            with storage_timer('strava_activities', 'compact'):
+                for collection, records in (('strava_activities', self._activities),
+                                            ('strava_activity_days', self._days)):
+                    if storage.needs_compaction(self.athlete_id, collection):
+                        compacted = storage.compact(self.athlete_id, collection, records) or compacted
+            return compacted
+
+    def activities_between(self, start_day, end_day):
+        """Cached activities that started in [start_day, end_day], oldest first"""
+        with self._lock:
+            self._ensure_loaded()
+            found = []
+            day = start_day
+            while day <= end_day:
+                entry = self._days.get(day.isoformat())
+                if entry:
+                    found.extend(self._activities[i] for i in entry['ids'] if i in self._activities)
+                day += timedelta(days=1)
+        return sorted(found, key=lambda a: a['start_date'])
+
+    def invalidate(self, start_day=None, end_day=None):
+        """Mark days as stale so the next lookup refetches them (all days if no range)"""
+        with self._lock:
+            self._ensure_loaded()
+            if start_day is None:
+                stale = list(self._days)
+            else:
+                end_day = end_day or start_day
+                stale = [d for d in self._days if start_day.isoformat() <= d <= end_day.isoformat()]
+            expired = {d: {**self._days[d], 'fetched_at': 0} for d in stale}
+            self._persist({}, expired)
+            self._days.update(expired)
+            return len(stale)
+
+
+_strava_activity_caches = {}
+
+
+def get_strava_activity_cache(athlete_id):
+    """The StravaActivityCache for one athlete"""
+    return _per_athlete(
+        _strava_activity_caches, athlete_id,
+        lambda a: StravaActivityCache(a, STRAVA_CACHE_TTL)
+    )
+
+
+def fetch_strava_activities(token, after, before):
+    """Fetch every activity between two Unix timestamps, following pagination"""
+    headers = {'Authorization': f'Bearer {token}'}
+    activities = []
+    page = 1
+    while True:
+        response = strava_client.get(
+            f'{STRAVA_API_BASE}/athlete/activities',
+            headers=headers,
+            params={'after': after, 'before': before, 'per_page': STRAVA_PAGE_SIZE, 'page': page}
+        )
+        response.raise_for_status()
+        batch = response.json()
+        activities.extend(batch)
+        if len(batch) < STRAVA_PAGE_SIZE:
+            return activities
+        page += 1
+
+
+def get_cached_strava_activities(athlete_id, start_day, end_day, refresh=False):
+    """An athlete's activities in [start_day, end_day], fetching only stale or missing days.
+
+    Returns None when days need fetching and there is no valid Strava token.
+    """
+    cache = get_strava_activity_cache(athlete_id)
+    if refresh:
+        cache.invalidate(start_day, end_day)
+    stale = cache.stale_ranges(start_day, end_day)
+    if stale:
+        token = get_valid_strava_token(athlete_id)
+        if not token:
+            return None
+        for range_start, range_end in stale:
+            after, before = day_bounds(range_start, range_end)
+            fetched = fetch_strava_activities(token, after, before)
+            cache.store_range(range_start, range_end, fetched)
+    return cache.activities_between(start_day, end_day)
+
+
+def format_strava_runs(activities):
+    """Filter activities to runs and format them for the frontend.
+
+    Unit conversions, pace and duration splits are computed over whole
+    columns at once; only the final string formatting happens per run.
+    """
+    runs = [a for a in activities if a['type'] in ['Run', 'VirtualRun']]
+    if not runs:
+        return []
+    count = len(runs)
+    
+    distance_miles = np.fromiter((r['distance'] for r in runs), dtype=np.float64, count=count) / 1609.34
+    moving_time = np.fromiter((r['moving_time'] for r in runs), dtype=np.int64, count=count)
+    elevation_feet = np.fromiter((r['total_elevation_gain'] for r in runs), dtype=np.float64, count=count) * 3.28084
+    
+    # Calculate pace (runs with no distance get "N/A")
+    has_distance = distance_miles > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pace_minutes_per_mile = np.where(has_distance, (moving_time / 60) / distance_miles, 0.0)
+    pace_min = np.trunc(pace_minutes_per_mile)
+    pace_sec = np.trunc((pace_minutes_per_mile - pace_min) * 60)
+    
+    # Split duration into h/m/s
+    hours, remainder = np.divmod(moving_time, 3600)
+    minutes, seconds = np.divmod(remainder, 60)
+    
+    columns = zip(
+        runs, distance_miles.tolist(), has_distance.tolist(), pace_min.astype(np.int64).tolist(),
+        pace_sec.astype(np.int64).tolist(), hours.tolist(), minutes.tolist(), seconds.tolist(),
+        elevation_feet.tolist()
+    )
+    formatted_runs = []
+    for run, miles, has_pace, p_min, p_sec, h, m, s, elevation in columns:
+        formatted_runs.append({
+            'id': run['id'],
+            'name': run['name'],
+            'distance': round(miles, 2),
+            'duration': f"{h}:{m:02d}:{s:02d}" if h > 0 else f"{m}:{s:02d}",
+            'pace': f"{p_min}:{p_sec:02d} min/mi" if has_pace else "N/A",
+            'moving_time': run['moving_time'],
+            'elapsed_time': run['elapsed_time'],
+            'total_elevation_gain': round(elevation, 0),
+            'start_date': run['start_date'],
+            'average_heartrate': run.get('average_heartrate'),
+            'max_heartrate': run.get('max_heartrate')
+        })
+    return formatted_runs
+
+
 @app.route('/api/strava/activities/<date>')
 def get_strava_activities(date):
     """Get Strava activities for a specific date (YYYY-MM-DD)"""
-    token = get_valid_strava_token()
-    
-    if not token:
-        return jsonify({'error': 'Not authorized with Strava. Please connect your Strava account first.'}), 401
+    try:
+        target_day = datetime.strptime(date, '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'error': f'Invalid date: {date}'}), 400
     
+    athlete_id = current_athlete_id()
     try:
-        # Parse date
-        target_date = datetime.strptime(date, '%Y-%m-%d')
-        
-        # Get start and end of day (Unix timestamps)
-        start_of_day = target_date.replace(hour=0, minute=0, second=0)
-        end_of_day = target_date.replace(hour=23, minute=59, second=59)
-        
-        # Fetch activities from Strava
-        headers = {'Authorization': f'Bearer {token}'}
-        params = {
-            'after': int(start_of_day.timestamp()),
-            'before': int(end_of_day.timestamp()),
-            'per_page': 20
-        }
-        
-        response = requests.get(
-            f'{STRAVA_API_BASE}/athlete/activities',
-            headers=headers,
-            params=params
+        activities = get_cached_strava_activities(
+            athlete_id, target_day, target_day, refresh=request.args.get('refresh') == '1'
         )
-        response.raise_for_status()
-        activities = response.json()
-        
-        # Filter to only runs
-        runs = [a for a in activities if a['type'] in ['Run', 'VirtualRun']]
-        
-        # Format for frontend
-        formatted_runs = []
-        for run in runs:
-            distance_miles = run['distance'] / 1609.34
-            moving_time_seconds = run['moving_time']
-            
-            # Calculate pace
-            if distance_miles > 0:
-                pace_minutes_per_mile = (moving_time_seconds / 60) / distance_miles
-                pace_min = int(pace_minutes_per_mile)
-                pace_sec = int((pace_minutes_per_mile - pace_min) * 60)
-                pace_str = f"{pace_min}:{pace_sec:02d} min/mi"
-            else:
-                pace_str = "N/A"
-            
-            # Format duration
-            hours = moving_time_seconds // 3600
-            minutes = (moving_time_seconds % 3600) // 60
-            seconds = moving_time_seconds % 60
-            if hours > 0:
-                duration_str = f"{hours}:{minutes:02d}:{seconds:02d}"
-            else:
-                duration_str = f"{minutes}:{seconds:02d}"
-            
-            formatted_runs.append({
-                'id': run['id'],
-                'name': run['name'],
-                'distance': round(distance_miles, 2),
-                'duration': duration_str,
-                'pace': pace_str,
-                'moving_time': moving_time_seconds,
-                'elapsed_time': run['elapsed_time'],
-                'total_elevation_gain': round(run['total_elevation_gain'] * 3.28084, 0),
-                'start_date': run['start_date'],
-                'average_heartrate': run.get('average_heartrate'),
-                'max_heartrate': run.get('max_heartrate')
-            })
+        if activities is None:
+            return jsonify({'error': 'Not authorized with Strava. Please connect your Strava account first.'}), 401
         
-        return jsonify({'runs': formatted_runs, 'count': len(formatted_runs)})
+        formatted_runs = format_strava_runs(activities)
+        slot = athlete_plan(athlete_id).slot_on(target_day)
+        return jsonify({
+            'runs': formatted_runs,
+            'count': len(formatted_runs),
+            'workout': {'key': slot.key, 'week': slot.week_num, 'day': slot.day_idx} if slot else None
+        })
     
+    except StravaRateLimitError as e:
+        return rate_limited_response(e, {'error': str(e)})
     except Exception as e:
-        print(f"Error fetching Strava activities: {e}")
+        logger.error('Error fetching Strava activities', extra={'athlete_id': athlete_id, 'date': date, 'error': str(e)})
         return jsonify({'error': f'Failed to fetch activities: {str(e)}'}), 500
 
 
+def strava_run_workout_fields(run):
+    """Workout log fields for a formatted Strava run, as the import modal fills them"""
+    notes = f"📲 Imported from Strava: {run['name']}\n"
+    if run['total_elevation_gain'] > 0:
+        notes += f"⛰️ Elevation: {run['total_elevation_gain']:g} ft\n"
+    if run.get('average_heartrate'):
+        notes += f"❤️ Avg HR: {run['average_heartrate']} bpm"
+        if run.get('max_heartrate'):
+            notes += f" (Max: {run['max_heartrate']})"
+        notes += '\n'
+    return {
+        'completed': run['distance'] > 0,
+        'notes': notes,
+        'actual_miles': str(run['distance']),
+        'actual_pace': run['pace'] if run['pace'] != 'N/A' else '',
+        'duration': run['duration'],
+        'strava_data': run
+    }
+
+
+def match_strava_runs(athlete_id, runs):
+    """Log runs into an athlete's plan slots by date, never overwriting a completed workout.
+
+    When several runs share a day the longest one is used.
+    """
+    plan = athlete_plan(athlete_id)
+    store = get_workout_store(athlete_id)
+    by_slot = {}
+    for run in runs:
+        slot = plan.slot_on(activity_local_date(run))
+        if slot and (slot.key not in by_slot or run['distance'] > by_slot[slot.key]['distance']):
+            by_slot[slot.key] = run
+
+    updates, skipped = {}, []
+    # Runs on the job queue alongside request threads: holding the store lock
+    # from the completed check to the write keeps a log saved in between from
+    # being overwritten with Strava data
+    with store.locked():
+        for key, run in sorted(by_slot.items(), key=lambda item: plan.slot_by_key[item[0]].date):
+            workout_info = store.get(key) or {}
+            if workout_info.get('completed'):
+                skipped.append(key)
+                continue
+            workout_info.update(strava_run_workout_fields(run))
+            workout_info['date_logged'] = datetime.now().isoformat()
+            updates[key] = workout_info
+        if updates and not store.put_many(updates):
+            raise RuntimeError('Failed to save matched workouts')
+    return list(updates), skipped
+
+
+def sync_strava(athlete_id, start_day, end_day, refresh=False, auto_match=True):
+    """Backfill an athlete's Strava runs for a date range and match them to workouts.
+
+    Returns None when there is no valid Strava token.
+    """
+    activities = get_cached_strava_activities(athlete_id, start_day, end_day, refresh=refresh)
+    if activities is None:
+        return None
+    runs = format_strava_runs(activities)
+    matched, skipped = match_strava_runs(athlete_id, runs) if auto_match else ([], [])
+    return {
+        'start': start_day.isoformat(),
+        'end': end_day.isoformat(),
+        'run_count': len(runs),
+        'matched': matched,
+        'skipped': skipped
+    }
+
+
+@app.route('/api/strava/sync', methods=['POST'])
+def strava_sync():
+    """Backfill Strava runs for the plan window (or start/end) and match them to workouts.
+
+    With "background": true the sync runs as a job and this returns 202 with
+    the job to poll at /api/jobs/<job_id>.
+    """
+    data = request.get_json(silent=True) or {}
+    athlete_id = current_athlete_id()
+    plan = athlete_plan(athlete_id)
+    try:
+        start_day = date.fromisoformat(data['start']) if data.get('start') else plan.start_date
+        end_day = date.fromisoformat(data['end']) if data.get('end') else plan.end_date
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    if end_day < start_day:
+        return jsonify({'success': False, 'error': 'end must not be before start'}), 400
+    refresh, auto_match = bool(data.get('refresh')), data.get('auto_match', True)
+    
+    if data.get('background'):
+        job = job_queue.submit(
+            'strava_sync', athlete_id, _strava_sync_job, athlete_id, start_day, end_day, refresh, auto_match,
+            dedupe_key=('strava_sync', athlete_id, start_day, end_day)
+        )
+        return jsonify({'success': True, 'job': job}), 202
+    
+    try:
+        result = sync_strava(athlete_id, start_day, end_day, refresh, auto_match)
+        if result is None:
+            return jsonify({'success': False, 'error': 'Not authorized with Strava. Please connect your Strava account first.'}), 401
+        return jsonify({'success': True, **result})
+    
+    except StravaRateLimitError as e:
+        return rate_limited_response(e, {'success': False, 'error': str(e)})
+    except Exception as e:
+        logger.error('Error syncing Strava activities', extra={'athlete_id': athlete_id, 'error': str(e)})
+        return jsonify({'success': False, 'error': f'Failed to sync activities: {str(e)}'}), 500
+
+@app.route('/api/strava/cache/invalidate', methods=['POST'])
+def strava_cache_invalidate():
+    """Mark cached Strava days as stale (optional start/end YYYY-MM-DD, default all)"""
+    data = request.get_json(silent=True) or {}
+    try:
+        start_day = datetime.strptime(data['start'], '%Y-%m-%d').date() if data.get('start') else None
+        end_day = datetime.strptime(data['end'], '%Y-%m-%d').date() if data.get('end') else None
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    invalidated = get_strava_activity_cache(current_athlete_id()).invalidate(start_day, end_day)
+    return jsonify({'success': True, 'invalidated_days': invalidated})
+
+# ============================================================================
+# BACKGROUND JOBS
+# ============================================================================
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_HISTORY_LIMIT = int(os.getenv('JOB_HISTORY_LIMIT', '200'))
+
+
+class JobQueue:
+    """In-process worker pool for Strava and storage work kept off request threads.
+
+    Each job is a callable plus a kind and athlete. Its status (queued,
+    running, done, failed), result or error is kept in memory for the jobs
+    API, along with the last `history_limit` finished jobs. Submitting with a
+    dedupe_key that matches a queued or running job returns that job instead
+    of queueing the work twice. Worker threads start on the first submit.
+    """
+
+    def __init__(self, workers, history_limit):
+        self.workers = workers
+        self.history_limit = history_limit
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)
+        self._jobs = {}
+        self._active = {}
+        self._threads = []
+
+    def submit(self, kind, athlete_id, fn, *args, dedupe_key=None):
+        """Queue fn(*args) and return the job's status record"""
+        with self._lock:
+            if dedupe_key is not None and dedupe_key in self._active:
+                return dict(self._jobs[self._active[dedupe_key]])
+            job = {
+                'job_id': uuid.uuid4().hex,
+                'kind': kind,
+                'athlete_id': athlete_id,
+                'status': 'queued',
+                'submitted_at': datetime.now().isoformat(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None
+            }
+            self._jobs[job['job_id']] = job
+            if dedupe_key is not None:
+                self._active[dedupe_key] = job['job_id']
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f'job-worker-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._queue.put((job['job_id'], dedupe_key, fn, args))
+            return dict(job)
+
+    def _work(self):
+        while True:
+            job_id, dedupe_key, fn, args = self._queue.get()
+            with self._lock:
+                job = self._jobs[job_id]
+                job['status'] = 'running'
+                job['started_at'] = datetime.now().isoformat()
+            try:
+                result, error = fn(*args), None
+            except Exception as e:
+                logger.error('Background job failed', extra={
+                    'job_id': job_id, 'kind': job['kind'], 'athlete_id': job['athlete_id'], 'error': str(e)
+                })
+                result, error = None, str(e)
+            with self._lock:
+                job['status'] = 'failed' if error else 'done'
+                job['result'] = result
+                job['error'] = error
+                job['finished_at'] = datetime.now().isoformat()
+                if dedupe_key is not None:
+                    self._active.pop(dedupe_key, None)
+                self._prune()
+                self._finished.notify_all()
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job['finished_at']]
+        for job_id in finished[:max(len(finished) - self.history_limit, 0)]:
+            del self._jobs[job_id]
+
+    def counts(self):
+        """Number of known jobs in each status"""
+        counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job['status']] += 1
+        return counts
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def list(self, athlete_id=None):
+        """Known jobs, newest first, optionally for one athlete"""
+        with self._lock:
+            return [
+                dict(job) for job in reversed(self._jobs.values())
+                if athlete_id is None or job['athlete_id'] == athlete_id
+            ]
+
+    def wait(self, job_id, timeout=None):
+        """Block until a job finishes (or timeout); returns its status record"""
+        with self._finished:
+            self._finished.wait_for(
+                lambda: job_id not in self._jobs or self._jobs[job_id]['finished_at'], timeout
+            )
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+
+job_queue = JobQueue(JOB_WORKERS, JOB_HISTORY_LIMIT)
+metrics.gauge('background_jobs', 'Background jobs by status', lambda: [
+    ({'status': status}, count) for status, count in job_queue.counts().items()
+])
+
+
+def _strava_sync_job(athlete_id, start_day, end_day, refresh, auto_match):
+    result = sync_strava(athlete_id, start_day, end_day, refresh, auto_match)
+    if result is None:
+        raise RuntimeError('Not authorized with Strava')
+    return result
+
+
+def _strava_cache_warm_job(athlete_id):
+    """Fetch the athlete's plan window (up to today) into the activity cache"""
+    plan = athlete_plan(athlete_id)
+    end_day = min(plan.end_date, date.today())
+    if end_day < plan.start_date:
+        return {'activities': 0}
+    activities = get_cached_strava_activities(athlete_id, plan.start_date, end_day)
+    if activities is None:
+        raise RuntimeError('Not authorized with Strava')
+    return {'start': plan.start_date.isoformat(), 'end': end_day.isoformat(), 'activities': len(activities)}
+
+
+def _strava_token_refresh_job(athlete_id):
+    """Refresh the athlete's token now if it expires within STRAVA_TOKEN_REFRESH_AHEAD"""
+    cache = get_strava_token_cache(athlete_id)
+    if cache.access_token(margin=STRAVA_TOKEN_REFRESH_AHEAD) is None:
+        raise RuntimeError('Not authorized with Strava')
+    return {'expires_at': cache.info()['expires_at']}
+
+
+def _compact_journals_job(athlete_id):
+    return {
+        'workouts': get_workout_store(athlete_id).compact_journal(),
+        'strava_activities': get_strava_activity_cache(athlete_id).compact_journal()
+    }
+
+
+# Jobs that can be started through POST /api/jobs
+JOB_KINDS = {
+    'strava_cache_warm': _strava_cache_warm_job,
+    'strava_token_refresh': _strava_token_refresh_job,
+    'compact_journal': _compact_journals_job
+}
+
+
+@app.route('/api/jobs')
+def list_jobs():
+    """List this athlete's recent background jobs"""
+    return jsonify({'jobs': job_queue.list(current_athlete_id())})
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Start a background job: {"kind": "strava_cache_warm" | "strava_token_refresh" | "compact_journal"}"""
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    if kind not in JOB_KINDS:
+        return jsonify({'success': False, 'error': f"kind must be one of {', '.join(JOB_KINDS)}"}), 400
+    athlete_id = current_athlete_id()
+    job = job_queue.submit(kind, athlete_id, JOB_KINDS[kind], athlete_id, dedupe_key=(kind, athlete_id))
+    return jsonify({'success': True, 'job': job}), 202
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    """Get the status, result or error of one of this athlete's jobs"""
+    job = job_queue.get(job_id)
+    if job is None or job['athlete_id'] != current_athlete_id():
+        return jsonify({'error': f'Unknown job: {job_id}'}), 404
+    return jsonify(job)
+
+# ============================================================================
+# STRAVA WEBHOOK
+# ============================================================================
+
+# Strava push subscriptions (https://developers.strava.com/docs/webhooks/):
+# the verify token is echoed back during the subscription handshake, and
+# events are only accepted for our own subscription id when it is set
+STRAVA_WEBHOOK_VERIFY_TOKEN = os.getenv('STRAVA_WEBHOOK_VERIFY_TOKEN', '')
+STRAVA_WEBHOOK_SUBSCRIPTION_ID = os.getenv('STRAVA_WEBHOOK_SUBSCRIPTION_ID', '')
+STRAVA_WEBHOOK_AUTO_MATCH = os.getenv('STRAVA_WEBHOOK_AUTO_MATCH', '1') == '1'
+
+
+# Strava athlete id -> {'athlete_ids': [...]}, maintained by StravaTokenCache.set/clear
+strava_owner_directory = Directory('strava_owners')
+_strava_owner_lock = threading.Lock()
+_strava_owner_backfilled = False
+
+
+def link_strava_owner(owner_id, athlete_id):
+    """Record that `athlete_id` is connected to the Strava account `owner_id`"""
+    if owner_id is None:
+        return
+    with _strava_owner_lock:
+        entry = strava_owner_directory.get(str(owner_id)) or {'athlete_ids': []}
+        if athlete_id not in entry['athlete_ids']:
+            entry['athlete_ids'] = sorted([*entry['athlete_ids'], athlete_id])
+            strava_owner_directory.put(str(owner_id), entry)
+
+
+def unlink_strava_owner(owner_id, athlete_id):
+    """Drop `athlete_id` from the athletes connected to `owner_id`"""
+    if owner_id is None:
+        return
+    with _strava_owner_lock:
+        entry = strava_owner_directory.get(str(owner_id))
+        if not entry or athlete_id not in entry['athlete_ids']:
+            return
+        remaining = [a for a in entry['athlete_ids'] if a != athlete_id]
+        if remaining:
+            strava_owner_directory.put(str(owner_id), {'athlete_ids': remaining})
+        else:
+            strava_owner_directory.delete(str(owner_id))
+
+
+def _backfill_strava_owners():
+    """Index tokens stored before the owner index existed (once per process)"""
+    global _strava_owner_backfilled
+    if _strava_owner_backfilled:
+        return
+    for athlete_id in {DEFAULT_ATHLETE_ID, *athlete_directory.all()}:
+        token = get_strava_token_cache(athlete_id).info()
+        if token:
+            link_strava_owner(token.get('athlete_id'), athlete_id)
+    _strava_owner_backfilled = True
+
+
+def strava_owner_athletes(owner_id):
+    """Athletes whose connected Strava account is `owner_id`"""
+    _backfill_strava_owners()
+    entry = strava_owner_directory.get(str(owner_id))
+    return list(entry['athlete_ids']) if entry else []
+
+
+def _strava_webhook_job(event):
+    """Apply one push event: fetch created/updated activities, drop deleted ones"""
+    athletes = strava_owner_athletes(event['owner_id'])
+    if event['object_type'] == 'athlete':
+        # The only athlete event Strava sends is a deauthorization. The event
+        # itself proves nothing, so the token is dropped only once Strava
+        # confirms it no longer works
+        if (event.get('updates') or {}).get('authorized') == 'false':
+            deauthorized = [a for a in athletes if get_strava_token_cache(a).clear_if_revoked()]
+            return {'athletes': athletes, 'deauthorized': deauthorized}
+        return {'athletes': athletes}
+    
+    activity_id = str(event['object_id'])
+    if event['aspect_type'] == 'delete':
+        removed = [a for a in athletes if get_strava_activity_cache(a).remove_activity(activity_id)]
+        return {'activity_id': activity_id, 'removed': removed}
+    
+    matched = {}
+    for athlete_id in athletes:
+        token = get_valid_strava_token(athlete_id)
+        if not token:
+            continue
+        response = strava_client.get(
+            f'{STRAVA_API_BASE}/activities/{activity_id}',
+            headers={'Authorization': f'Bearer {token}'}
+        )
+        response.raise_for_status()
+        activity = response.json()
+        get_strava_activity_cache(athlete_id).store_activity(activity)
+        matched[athlete_id] = (
+            match_strava_runs(athlete_id, format_strava_runs([activity]))[0]
+            if STRAVA_WEBHOOK_AUTO_MATCH else []
+        )
+    return {'activity_id': activity_id, 'matched': matched}
+
+
+@app.route('/api/strava/webhook')
+def strava_webhook_validate():
+    """Answer Strava's push-subscription validation handshake"""
+    if not STRAVA_WEBHOOK_VERIFY_TOKEN:
+        return jsonify({'error': 'Strava webhook not configured. Please set STRAVA_WEBHOOK_VERIFY_TOKEN in environment.'}), 500
+    verify_token = request.args.get('hub.verify_token', '')
+    if request.args.get('hub.mode') != 'subscribe' or not hmac.compare_digest(verify_token, STRAVA_WEBHOOK_VERIFY_TOKEN):
+        return jsonify({'error': 'Invalid verify token'}), 403
+    return jsonify({'hub.challenge': request.args.get('hub.challenge', '')})
+
+@app.route('/api/strava/webhook', methods=['POST'])
+def strava_webhook_event():
+    """Acknowledge a Strava push event immediately and process it as a background job"""
+    # Events carry no signature, so without a subscription id to check
+    # against the endpoint would act on anyone's POSTs
+    if not STRAVA_WEBHOOK_SUBSCRIPTION_ID:
+        return jsonify({'success': False, 'error': 'Strava webhook not configured. Please set STRAVA_WEBHOOK_SUBSCRIPTION_ID in environment.'}), 500
+    event = request.get_json(silent=True)
+    if (not isinstance(event, dict) or event.get('object_type') not in ('activity', 'athlete') or
+            event.get('aspect_type') not in ('create', 'update', 'delete') or
+            not isinstance(event.get('object_id'), int) or not isinstance(event.get('owner_id'), int)):
+        return jsonify({'success': False, 'error': 'Invalid event'}), 400
+    if str(event.get('subscription_id')) != STRAVA_WEBHOOK_SUBSCRIPTION_ID:
+        return jsonify({'success': False, 'error': 'Unknown subscription'}), 403
+    
+    # Strava retries events that aren't acknowledged within 2 seconds, so the
+    # activity is fetched on the job queue; repeats of a queued event coalesce
+    job = job_queue.submit(
+        'strava_webhook', None, _strava_webhook_job, event,
+        dedupe_key=('strava_webhook', event['object_type'], event['object_id'], event['aspect_type'])
+    )
+    return jsonify({'success': True, 'job_id': job['job_id']})
+
+_startup['import_seconds'] = time.perf_counter() - _startup_started
+logger.info('Startup complete', extra=startup_report())
+if WARMUP_ON_START:
+    threading.Thread(target=_warm_up_in_background, name='warmup', daemon=True).start()
+
 if __name__ == '__main__':
     # For Google Cloud Run
     port = int(os.environ.get('PORT', 8080))
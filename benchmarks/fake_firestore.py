@@ -0,0 +1,119 @@
+"""In-memory stand-in for the slice of google.cloud.firestore that app.py uses.
+
+Counts billable document reads and writes and round trips, and can add a
+fixed delay per round trip so storage-bound paths behave like a remote
+database rather than a dict lookup.
+"""
+import threading
+import time
+
+
+class FakeFirestore:
+    def __init__(self, rpc_latency=0.0):
+        self.rpc_latency = rpc_latency
+        self.collections = {}
+        self.ops = {'reads': 0, 'writes': 0, 'rpcs': 0}
+        self._lock = threading.Lock()
+
+    def _rpc(self, reads=0, writes=0):
+        if self.rpc_latency:
+            time.sleep(self.rpc_latency)
+        with self._lock:
+            self.ops['rpcs'] += 1
+            self.ops['reads'] += reads
+            self.ops['writes'] += writes
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def reset_counts(self):
+        with self._lock:
+            self.ops = {'reads': 0, 'writes': 0, 'rpcs': 0}
+
+
+class FakeCollection:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+
+    def _docs(self):
+        return self._db.collections.setdefault(self.path, {})
+
+    def document(self, doc_id):
+        return FakeDocument(self._db, self.path, doc_id)
+
+    def stream(self):
+        docs = list(self._docs().items())
+        self._db._rpc(reads=len(docs))
+        for doc_id, data in docs:
+            yield FakeSnapshot(doc_id, dict(data))
+
+    def list_documents(self):
+        self._db._rpc()
+        return [FakeDocument(self._db, self.path, doc_id) for doc_id in list(self._docs())]
+
+
+class FakeDocument:
+    def __init__(self, db, collection_path, doc_id):
+        self._db = db
+        self._collection_path = collection_path
+        self.id = doc_id
+
+    def _docs(self):
+        return self._db.collections.setdefault(self._collection_path, {})
+
+    def collection(self, name):
+        return FakeCollection(self._db, f'{self._collection_path}/{self.id}/{name}')
+
+    def get(self):
+        self._db._rpc(reads=1)
+        data = self._docs().get(self.id)
+        return FakeSnapshot(self.id, dict(data) if data is not None else None)
+
+    def set(self, data):
+        self._db._rpc(writes=1)
+        self._docs()[self.id] = dict(data)
+
+    def update(self, data):
+        self._db._rpc(writes=1)
+        self._docs()[self.id].update(data)
+
+    def delete(self):
+        self._db._rpc(writes=1)
+        self._docs().pop(self.id, None)
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self._db = db
+        self._ops = []
+
+    def set(self, ref, data):
+        self._ops.append((ref, dict(data)))
+
+    def delete(self, ref):
+        self._ops.append((ref, None))
+
+    def commit(self):
+        if len(self._ops) > 500:
+            raise ValueError('Firestore batches are limited to 500 writes')
+        self._db._rpc(writes=len(self._ops))
+        for ref, data in self._ops:
+            if data is None:
+                ref._docs().pop(ref.id, None)
+            else:
+                ref._docs()[ref.id] = data
+        self._ops = []
@@ -0,0 +1,336 @@
+"""Reproducible load test for the training tracker API.
+
+Each scenario (storage backend x dataset size) runs in a fresh Python
+process: the workout store is seeded with N records in the json, sqlite or
+an in-memory Firestore backend, app.py is served on a
+threaded local WSGI server with Strava pointed at a stub, and a pool of
+concurrent clients drives a fixed, seeded mix of log_workout, get_stats,
+get_workouts, get_plan, analytics and Strava requests. Reports throughput, p50/p99
+latency per route and the storage operations the run caused (from /metrics,
+plus document reads/writes for the in-memory Firestore stand-in).
+
+    python benchmarks/loadtest.py
+    python benchmarks/loadtest.py --records 91,1000,10000 --clients 16 --requests 4000
+    python benchmarks/loadtest.py --backend firestore --firestore-latency-ms 5 --json results.json
+    python benchmarks/loadtest.py --backend sqlite --records 10000
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# (name, weight) of each request kind in the client mix
+REQUEST_MIX = (
+    ('log_workout', 20),
+    ('get_stats', 25),
+    ('get_workouts', 10),
+    ('get_workouts_since', 15),
+    ('get_plan', 15),
+    ('analytics', 5),
+    ('strava_activities', 8),
+    ('strava_sync', 2),
+)
+
+
+def seed_records(count, rng):
+    """`count` workout records keyed like the app's w{week}_d{day}"""
+    records = {}
+    for i in range(count):
+        records[f'w{i // 7 + 1}_d{i % 7}'] = {
+            'completed': True,
+            'actual_miles': f'{rng.uniform(3, 12):.1f}',
+            'actual_pace': f'{rng.randint(8, 10)}:{rng.randint(0, 59):02d}',
+            'notes': 'seeded',
+            'logged_at': '2025-12-01T07:00:00'
+        }
+    return records
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def scrape_storage_counts(base_url):
+    """{(metric, store, op): value} for the storage counters in /metrics"""
+    counts = {}
+    text = requests.get(f'{base_url}/metrics', timeout=30).text
+    for line in text.splitlines():
+        if line.startswith('storage_operation_duration_seconds_count{'):
+            metric = 'calls'
+        elif line.startswith('storage_records_total{'):
+            metric = 'records'
+        else:
+            continue
+        labels_text, value = line[line.index('{') + 1:].rsplit('} ', 1)
+        labels = dict(pair.split('=', 1) for pair in labels_text.split(','))
+        key = (metric, labels['store'].strip('"'), labels['op'].strip('"'))
+        counts[key] = counts.get(key, 0) + float(value)
+    return counts
+
+
+class Client(threading.Thread):
+    """One simulated browser session issuing `count` requests from the mix"""
+
+    def __init__(self, base_url, count, seed, plan, results):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.count = count
+        self.rng = random.Random(seed)
+        self.plan = plan
+        self.results = results
+        self.session = requests.Session()
+        self.plan_etag = None
+        self.version = None
+        self._kinds = [name for name, _ in REQUEST_MIX]
+        self._weights = [weight for _, weight in REQUEST_MIX]
+
+    def _request(self, kind):
+        url = self.base_url
+        if kind == 'log_workout':
+            week = self.rng.randint(1, self.plan['num_weeks'])
+            return self.session.post(f'{url}/api/log_workout', json={
+                'week': week, 'day': self.rng.randint(0, 6), 'completed': True,
+                'actual_miles': f'{self.rng.uniform(3, 12):.1f}', 'notes': 'load test'
+            }, timeout=60)
+        if kind == 'get_stats':
+            return self.session.get(f'{url}/api/get_stats', timeout=60)
+        if kind == 'get_workouts':
+            return self.session.get(f'{url}/api/get_workouts', timeout=60)
+        if kind == 'get_workouts_since':
+            # The first poll (since=0) is a full resync that hands back the version to poll from
+            response = self.session.get(f'{url}/api/get_workouts', params={'since': self.version or 0}, timeout=60)
+            if response.ok:
+                self.version = response.json().get('version', self.version)
+            return response
+        if kind == 'get_plan':
+            headers = {'If-None-Match': self.plan_etag} if self.plan_etag else {}
+            response = self.session.get(f'{url}/api/get_plan', headers=headers, timeout=60)
+            self.plan_etag = response.headers.get('ETag', self.plan_etag)
+            return response
+        if kind == 'analytics':
+            return self.session.get(f'{url}/api/analytics', timeout=60)
+        if kind == 'strava_activities':
+            day = self.plan['start_date'] + timedelta(days=self.rng.randrange(self.plan['days']))
+            return self.session.get(f'{url}/api/strava/activities/{day.isoformat()}', timeout=60)
+        if kind == 'strava_sync':
+            return self.session.post(f'{url}/api/strava/sync', json={'auto_match': False}, timeout=60)
+        raise ValueError(kind)
+
+    def run(self):
+        for _ in range(self.count):
+            kind = self.rng.choices(self._kinds, self._weights)[0]
+            started = time.perf_counter()
+            try:
+                response = self._request(kind)
+                ok = response.status_code < 400
+            except requests.RequestException:
+                ok = False
+            self.results.append((kind, time.perf_counter() - started, ok))
+
+
+def run_scenario(args):
+    """Run one backend/record-count scenario in this process and return its results"""
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    records = seed_records(args.scenario_records, rng)
+
+    sys.path.insert(0, BENCH_DIR)
+    from stub_strava import StubStrava, generate_runs
+    stub = StubStrava([], latency=args.strava_latency_ms / 1000)
+
+    os.environ.update({
+        'WORKOUT_DATA_FILE': os.path.join(workdir, 'workout_data.json'),
+        'STRAVA_ACTIVITIES_FILE': os.path.join(workdir, 'strava_activities.json'),
+        'ATHLETES_FILE': os.path.join(workdir, 'athletes.json'),
+        'PLANS_FILE': os.path.join(workdir, 'plans.json'),
+        'STRAVA_API_BASE': f'{stub.url}/api/v3',
+        'STRAVA_TOKEN_URL': f'{stub.url}/oauth/token',
+        'STRAVA_CLIENT_ID': 'bench',
+        'STRAVA_CLIENT_SECRET': 'bench',
+        'STRAVA_CACHE_DAYS_FILE': os.path.join(workdir, 'strava_activity_days.json'),
+        'STRAVA_TOKEN_FILE': os.path.join(workdir, 'strava_tokens.json'),
+        'STRAVA_OWNERS_FILE': os.path.join(workdir, 'strava_owners.json'),
+        'SQLITE_PATH': os.path.join(workdir, 'training.db'),
+        'STORAGE_BACKEND': 'sqlite' if args.scenario_backend == 'sqlite' else 'json',
+        'LOG_LEVEL': 'ERROR'
+    })
+    if args.scenario_backend == 'json':
+        with open(os.environ['WORKOUT_DATA_FILE'], 'w') as f:
+            json.dump(records, f)
+
+    sys.path.insert(0, REPO_DIR)
+    import app
+
+    fake_db = None
+    if args.scenario_backend == 'firestore':
+        from fake_firestore import FakeFirestore
+        fake_db = FakeFirestore(rpc_latency=args.firestore_latency_ms / 1000)
+        fake_db.collections['workouts'] = records
+        app.storage = app.FirestoreBackend(fake_db)
+    elif args.scenario_backend == 'sqlite':
+        app.storage.apply(app.DEFAULT_ATHLETE_ID, [('workouts', k, v) for k, v in records.items()])
+
+    plan = app.athlete_plan(app.DEFAULT_ATHLETE_ID)
+    plan_days = (plan.end_date - plan.start_date).days + 1
+    stub.set_activities(generate_runs(plan.start_date, plan_days))
+    token = {
+        'access_token': 'bench-access', 'refresh_token': 'bench-refresh',
+        'expires_at': int(time.time()) + 24 * 3600, 'athlete_id': 1
+    }
+    app.get_strava_token_cache(app.DEFAULT_ATHLETE_ID).set(token)
+
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    before = scrape_storage_counts(base_url)
+    fake_before = dict(fake_db.ops) if fake_db else None
+
+    started = time.perf_counter()
+    cold = requests.get(f'{base_url}/api/get_workouts', timeout=120)
+    cold_load = time.perf_counter() - started
+    cold.raise_for_status()
+
+    results = []
+    per_client, extra = divmod(args.requests, args.clients)
+    plan_shape = {'num_weeks': plan.num_weeks, 'start_date': plan.start_date, 'days': plan_days}
+    clients = [
+        Client(base_url, per_client + (1 if i < extra else 0), args.seed * 1000 + i, plan_shape, results)
+        for i in range(args.clients)
+    ]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - started
+
+    after = scrape_storage_counts(base_url)
+    server.shutdown()
+    stub.close()
+
+    latencies = {}
+    for kind, seconds, ok in results:
+        latencies.setdefault(kind, []).append((seconds, ok))
+    routes = {}
+    for kind, samples in sorted(latencies.items()):
+        times = sorted(s for s, _ in samples)
+        routes[kind] = {
+            'requests': len(samples),
+            'errors': sum(1 for _, ok in samples if not ok),
+            'p50_ms': percentile(times, 50) * 1000,
+            'p99_ms': percentile(times, 99) * 1000
+        }
+    all_times = sorted(seconds for _, seconds, _ in results)
+    storage = {}
+    for key in sorted(set(before) | set(after)):
+        delta = after.get(key, 0) - before.get(key, 0)
+        if delta:
+            metric, store, op = key
+            storage[f'{store}.{op}.{metric}'] = int(delta)
+
+    return {
+        'backend': args.scenario_backend,
+        'records': args.scenario_records,
+        'clients': args.clients,
+        'requests': len(results),
+        'errors': sum(1 for _, _, ok in results if not ok),
+        'seconds': elapsed,
+        'throughput_rps': len(results) / elapsed if elapsed else None,
+        'p50_ms': percentile(all_times, 50) * 1000,
+        'p99_ms': percentile(all_times, 99) * 1000,
+        'cold_load_ms': cold_load * 1000,
+        'routes': routes,
+        'storage_ops': storage,
+        'firestore_ops': (
+            {k: fake_db.ops[k] - fake_before[k] for k in fake_db.ops} if fake_db else None
+        ),
+        'strava_stub_requests': stub.requests
+    }
+
+
+def print_report(results):
+    print(f"{'backend':<10}{'records':>8}{'req/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}{'cold ms':>9}")
+    for r in results:
+        print(f"{r['backend']:<10}{r['records']:>8}{r['throughput_rps']:>9.1f}{r['p50_ms']:>9.2f}"
+              f"{r['p99_ms']:>9.2f}{r['errors']:>8}{r['cold_load_ms']:>9.1f}")
+        for kind, route in r['routes'].items():
+            print(f"    {kind:<20}{route['requests']:>6} req  p50 {route['p50_ms']:>8.2f} ms"
+                  f"  p99 {route['p99_ms']:>8.2f} ms  errors {route['errors']}")
+        ops = ', '.join(f'{k}={v}' for k, v in r['storage_ops'].items()) or 'none'
+        print(f"    storage: {ops}")
+        if r['firestore_ops']:
+            print(f"    firestore: {', '.join(f'{k}={v}' for k, v in r['firestore_ops'].items())}")
+        print(f"    strava stub requests: {r['strava_stub_requests']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', default='91,1000,10000',
+                        help='comma-separated dataset sizes to seed (default 91,1000,10000)')
+    parser.add_argument('--backend', choices=['json', 'sqlite', 'firestore', 'all'], default='all')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients (default 8)')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario (default 2000)')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the dataset and request mix')
+    parser.add_argument('--firestore-latency-ms', type=float, default=0.0,
+                        help='delay added to each in-memory Firestore round trip')
+    parser.add_argument('--strava-latency-ms', type=float, default=0.0,
+                        help='delay added to each stub Strava response')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--scenario-backend', help=argparse.SUPPRESS)
+    parser.add_argument('--scenario-records', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario_backend:
+        result = run_scenario(args)
+        with open(args.result_file, 'w') as f:
+            json.dump(result, f)
+        return
+
+    backends = ['json', 'sqlite', 'firestore'] if args.backend == 'all' else [args.backend]
+    sizes = [int(n) for n in args.records.split(',')]
+    results = []
+    for backend in backends:
+        for size in sizes:
+            with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+                result_file = f.name
+            cmd = [
+                sys.executable, os.path.abspath(__file__),
+                '--scenario-backend', backend, '--scenario-records', str(size),
+                '--clients', str(args.clients), '--requests', str(args.requests), '--seed', str(args.seed),
+                '--firestore-latency-ms', str(args.firestore_latency_ms),
+                '--strava-latency-ms', str(args.strava_latency_ms), '--result-file', result_file
+            ]
+            print(f'running {backend} with {size} records...', file=sys.stderr)
+            subprocess.run(cmd, check=True, cwd=REPO_DIR)
+            with open(result_file) as f:
+                results.append(json.load(f))
+            os.unlink(result_file)
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Stub Strava API for load tests.
+
+Serves the token endpoint, paginated /athlete/activities and single
+/activities/<id> lookups from a generated list of runs (one per day), with
+rate-limit headers generous enough that the client never throttles itself.
+"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def generate_runs(start_day, days, athlete_id=1):
+    """One run per day from start_day, at 7am UTC"""
+    runs = []
+    for i in range(days):
+        started = datetime.combine(start_day + timedelta(days=i), datetime.min.time(), timezone.utc) + timedelta(hours=7)
+        distance = 4000 + (i * 977) % 12000
+        moving_time = int(distance / 3.1)
+        runs.append({
+            'id': 10_000_000 + i,
+            'athlete': {'id': athlete_id},
+            'name': f'Run {i + 1}',
+            'type': 'Run',
+            'distance': float(distance),
+            'moving_time': moving_time,
+            'elapsed_time': moving_time + 60,
+            'total_elevation_gain': float(i % 90),
+            'start_date': started.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'average_heartrate': 140.0 + i % 20,
+            'max_heartrate': 165.0 + i % 15
+        })
+    return runs
+
+
+class StubStrava:
+    """Threaded HTTP server standing in for www.strava.com; `url` is its base"""
+
+    def __init__(self, activities, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.set_activities(activities)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def set_activities(self, activities):
+        self.activities = list(activities)
+        self._by_id = {a['id']: a for a in self.activities}
+        self._started = [
+            datetime.fromisoformat(a['start_date'].replace('Z', '+00:00')).timestamp() for a in self.activities
+        ]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('X-RateLimit-Limit', '1000000,10000000')
+                self.send_header('X-RateLimit-Usage', '0,0')
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                stub._count()
+                url = urlparse(self.path)
+                if url.path.endswith('/athlete/activities'):
+                    query = parse_qs(url.query)
+                    after, before = int(query['after'][0]), int(query['before'][0])
+                    page, per_page = int(query.get('page', ['1'])[0]), int(query.get('per_page', ['30'])[0])
+                    selected = [a for a, t in zip(stub.activities, stub._started) if after <= t <= before]
+                    return self._send(200, selected[(page - 1) * per_page:page * per_page])
+                if '/activities/' in url.path:
+                    activity = stub._by_id.get(int(url.path.rsplit('/', 1)[1]))
+                    return self._send(200, activity) if activity else self._send(404, {'message': 'Record Not Found'})
+                self._send(404, {'message': 'Not Found'})
+
+            def do_POST(self):
+                stub._count()
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self._send(200, {
+                    'access_token': 'bench-access', 'refresh_token': 'bench-refresh',
+                    'expires_at': int(time.time()) + 6 * 3600,
+                    'athlete': {'id': 1, 'firstname': 'Bench', 'lastname': 'Runner'}
+                })
+
+        return Handler
@@ -25,11 +25,14 @@ echo "🏗️  Building Docker image..."
 gcloud builds submit --tag gcr.io/$PROJECT_NAME/$SERVICE_NAME
 
 echo "🚀 Deploying to Cloud Run..."
+# One instance: workouts are served from an in-process copy, and live
+# updates, background jobs and metrics are per process as well
 gcloud run deploy $SERVICE_NAME \
   --image gcr.io/$PROJECT_NAME/$SERVICE_NAME \
   --platform managed \
   --region $REGION \
   --allow-unauthenticated \
+  --max-instances 1 \
   --project $PROJECT_NAME
 
 echo ""
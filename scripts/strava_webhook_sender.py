@@ -0,0 +1,61 @@
+"""Send fake Strava webhook traffic to a running app, for local testing.
+
+Runs the subscription handshake and then posts one push event shaped like
+Strava's. Pair it with a stub Strava API (STRAVA_API_BASE / STRAVA_TOKEN_URL
+in .env) that serves the activity the event refers to. The app only drops a
+token on --deauthorize once the stub answers 401 for it, and refuses events
+unless STRAVA_WEBHOOK_SUBSCRIPTION_ID matches --subscription-id.
+
+    python scripts/strava_webhook_sender.py --verify-token secret
+    python scripts/strava_webhook_sender.py --owner-id 134815 --object-id 1360128428
+    python scripts/strava_webhook_sender.py --owner-id 134815 --object-id 1360128428 --aspect delete
+    python scripts/strava_webhook_sender.py --owner-id 134815 --object-type athlete --aspect update --deauthorize
+"""
+import argparse
+import secrets
+import time
+
+import requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:8080/api/strava/webhook')
+    parser.add_argument('--verify-token', help='run the GET validation handshake with this token')
+    parser.add_argument('--owner-id', type=int, help='Strava athlete id that owns the object')
+    parser.add_argument('--object-id', type=int, help='activity id (or the athlete id for athlete events)')
+    parser.add_argument('--object-type', choices=['activity', 'athlete'], default='activity')
+    parser.add_argument('--aspect', choices=['create', 'update', 'delete'], default='create')
+    parser.add_argument('--subscription-id', type=int, default=1)
+    parser.add_argument('--deauthorize', action='store_true', help='send updates={"authorized": "false"}')
+    args = parser.parse_args()
+
+    if args.verify_token:
+        challenge = secrets.token_hex(8)
+        response = requests.get(args.url, params={
+            'hub.mode': 'subscribe',
+            'hub.verify_token': args.verify_token,
+            'hub.challenge': challenge
+        }, timeout=10)
+        echoed = response.ok and response.json().get('hub.challenge') == challenge
+        print(f"handshake: HTTP {response.status_code}, challenge {'echoed' if echoed else 'NOT echoed'}")
+
+    if args.owner_id is None:
+        return
+    event = {
+        'object_type': args.object_type,
+        'object_id': args.object_id if args.object_id is not None else args.owner_id,
+        'aspect_type': args.aspect,
+        'owner_id': args.owner_id,
+        'subscription_id': args.subscription_id,
+        'event_time': int(time.time()),
+        'updates': {'authorized': 'false'} if args.deauthorize else {}
+    }
+    started = time.perf_counter()
+    response = requests.post(args.url, json=event, timeout=10)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"event: HTTP {response.status_code} in {elapsed_ms:.1f} ms: {response.text.strip()}")
+
+
+if __name__ == '__main__':
+    main()